@@ -0,0 +1,53 @@
+"""
+micro benchmark comparing the pickle based session cookies of werkzeug with
+the tagged JSON format used by starflyer.
+
+usage: python benchmarks/sessions.py [number]
+"""
+
+import sys
+import timeit
+import datetime
+from werkzeug.contrib.securecookie import SecureCookie
+from starflyer.sessions import SecureCookieSession, TaggedJSONSerializer
+
+SECRET = "benchmark secret"
+
+class PickleSession(SecureCookie):
+    """the format used before"""
+
+class UncompressedSession(SecureCookieSession):
+    serialization_method = TaggedJSONSerializer(compress_threshold = None)
+
+def make_session_data(size):
+    """return session data with ``size`` flash messages and some typical keys"""
+    return {
+        'user_id'       : u"4f2a7c0e1d41c82b3c000001",
+        'logged_in'     : datetime.datetime(2012, 3, 4, 5, 6, 7),
+        '_permanent'    : True,
+        '_flashes'      : [(u"info", u"This is flash message number %s" %i) for i in range(size)],
+    }
+
+def bench(cls, data, number):
+    cookie = cls(data, SECRET).serialize()
+    save = timeit.timeit(lambda: cls(data, SECRET).serialize(), number = number)
+    load = timeit.timeit(lambda: cls.unserialize(cookie, SECRET), number = number)
+    assert cls.unserialize(cookie, SECRET) == data
+    return len(cookie), save / number * 1000000, load / number * 1000000
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    formats = [
+        ("pickle", PickleSession),
+        ("json", UncompressedSession),
+        ("json+zlib", SecureCookieSession),
+    ]
+    print "%-6s %-10s %8s %10s %10s" %("size", "format", "bytes", "save us", "load us")
+    for size in (0, 5, 20, 50):
+        data = make_session_data(size)
+        for name, cls in formats:
+            length, save, load = bench(cls, data, number)
+            print "%-6s %-10s %8d %10.1f %10.1f" %(size, name, length, save, load)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+micro benchmark of the WSGI entry point of an application.
+
+``process_request`` is replaced by a function returning a prebuilt response so
+that only the code in front of it is measured: the previous ``__call__`` which
+read ``shift_path_info`` from the config on each request, the current ``__call__``
+and calling the compiled ``app.wsgi_app`` directly.
+
+usage: python benchmarks/wsgi_call.py [number]
+
+the best of 5 runs of ``number`` calls is reported.
+"""
+
+import sys
+import timeit
+
+from werkzeug.test import EnvironBuilder
+from wsgiref.util import shift_path_info
+from starflyer import Application
+
+class BenchApplication(Application):
+
+    defaults = {
+        'server_name'           : "localhost",
+        'session_cookie_domain' : "localhost",
+    }
+
+    response = None
+
+    def process_request(self, request):
+        return self.response
+
+def legacy_call(self, environ, start_response):
+    """the entry point before the WSGI app was compiled"""
+    spi = int(self.config.get("shift_path_info", 0))
+    for i in range(0,spi):
+        shift_path_info(environ)
+    request = self.request_class(environ)
+    try:
+        response = self.process_request(request)
+    except Exception, e:
+        response = self.handle_exception(request, e)
+    return response(environ, start_response)
+
+class LegacyApplication(BenchApplication):
+    __call__ = legacy_call
+
+def start_response(status, headers, exc_info = None):
+    pass
+
+def main():
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for spi in (0, 1):
+        app = BenchApplication(__name__, shift_path_info = spi)
+        legacy_app = LegacyApplication(__name__, shift_path_info = spi)
+        app.response = legacy_app.response = app.response_class("ok")
+        environ = EnvironBuilder(path = "/prefix/path").get_environ()
+        candidates = [
+            ("legacy __call__", legacy_app),
+            ("__call__", app),
+            ("app.wsgi_app", app.wsgi_app),
+        ]
+        print "shift_path_info = %s" %spi
+        for name, func in candidates:
+            t = min(timeit.repeat(lambda: func(dict(environ), start_response), number = number, repeat = 5))
+            print "    %-18s %8.2f us/call" %(name, t / number * 1000000)
+
+if __name__ == "__main__":
+    main()
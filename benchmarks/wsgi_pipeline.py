@@ -0,0 +1,277 @@
+"""
+benchmark of the complete request pipeline of a starflyer application.
+
+Requests are created offline with werkzeug's ``EnvironBuilder`` and passed to
+``Application.__call__`` so this measures everything from URL matching to the
+finished response body but not the network or a WSGI server.
+
+Scenarios:
+
+* ``string``: a handler returning a string
+* ``json``: a handler using the ``asjson`` decorator
+* ``render``: a handler rendering a template via ``Handler.render()``
+* ``session``: reading and writing the session including flash messages
+* ``static``: a static file
+* ``redirect``: a handler returning a redirect
+* ``notfound``: a URL which does not exist
+* ``error``: a handler raising an exception which an error handler processes
+
+usage::
+
+    python benchmarks/wsgi_pipeline.py -n 5000 --modules 10
+    python benchmarks/wsgi_pipeline.py --save baseline.json
+    python benchmarks/wsgi_pipeline.py --compare baseline.json --threshold 0.1
+
+When comparing, the exit code is 1 if a scenario got slower than the threshold allows.
+If a scenario does not return its expected status code the benchmark aborts with exit code 2.
+"""
+
+import gc
+import sys
+import json
+import argparse
+import timeit
+
+from werkzeug.test import EnvironBuilder
+from starflyer import Application, Handler, Module, URL, asjson, redirect
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+timer = timeit.default_timer
+
+####
+#### the application
+####
+
+class StringHandler(Handler):
+    def get(self):
+        return "Hello World"
+
+class JSONHandler(Handler):
+    @asjson()
+    def get(self):
+        return {'id' : 12, 'name' : "benchmark", 'tags' : ["a", "b", "c"], 'score' : 1.5}
+
+class RenderHandler(Handler):
+    template = "bench.html"
+    def get(self):
+        return self.render(title = "Benchmark", items = range(20), flashes = [])
+
+class SessionHandler(Handler):
+    def get(self):
+        self.session['count'] = self.session.get('count', 0) + 1
+        self.flash("visit %s" %self.session['count'])
+        return repr(self.get_flashes())
+
+class RedirectHandler(Handler):
+    def get(self):
+        return redirect(self.url_for("string"))
+
+class ErrorHandler(Handler):
+    def get(self):
+        raise ValueError("benchmark error")
+
+class ValueErrorHandler(Handler):
+    def get(self, exception = None):
+        return "an error happened"
+
+class BenchModule(Module):
+    """a module with a route and hooks to measure the overhead of modules"""
+
+    routes = [
+        URL("/hello", "hello", StringHandler),
+    ]
+
+    def before_handler(self, handler):
+        handler.bench = True
+
+    def get_render_context(self, handler):
+        return {'module_value' : self.name}
+
+class BenchApplication(Application):
+
+    defaults = {
+        'secret_key'            : "benchmark",
+        'server_name'           : "example.org",
+        'session_cookie_domain' : "example.org", # werkzeug does not accept domains without a dot
+    }
+
+    routes = [
+        URL("/string",      "string",       StringHandler),
+        URL("/json",        "json",         JSONHandler),
+        URL("/render",      "render",       RenderHandler),
+        URL("/session",     "session",      SessionHandler),
+        URL("/redirect",    "redirect",     RedirectHandler),
+        URL("/error",       "error",        ErrorHandler),
+    ]
+
+    error_handlers = {
+        ValueError : ValueErrorHandler,
+    }
+
+# name, path and the expected status code
+scenarios = [
+    ("string",      "/string",              200),
+    ("json",        "/json",                200),
+    ("render",      "/render",              200),
+    ("session",     "/session",             200),
+    ("static",      "/static/bench.css",    200),
+    ("redirect",    "/redirect",            302),
+    ("notfound",    "/does/not/exist",      404),
+    ("error",       "/error",               200),
+]
+
+def create_app(modules = 0, **config):
+    """create the benchmark application with ``modules`` modules loaded"""
+    class App(BenchApplication):
+        pass
+    App.modules = [BenchModule(__name__, name = "mod%s" %i, url_prefix = "/mod%s" %i)() for i in range(modules)]
+    return App(__name__, **config)
+
+####
+#### running the benchmarks
+####
+
+def call_app(app, environ):
+    """run one request and consume the response"""
+    status = []
+    def start_response(s, headers, exc_info = None):
+        status.append(s)
+        status.append(headers)
+    rv = app(dict(environ), start_response)
+    try:
+        for data in rv:
+            pass
+    finally:
+        if hasattr(rv, "close"):
+            rv.close()
+    return status
+
+def get_status_code(status):
+    return int(status.split(None, 1)[0])
+
+def create_environ(app, path, expected_status):
+    """create the environment for a request. For the session scenario a session
+    cookie is obtained first so that the session is read and written. Raises
+    ``ValueError`` if the request does not return ``expected_status`` as otherwise
+    we would measure an error page instead of the scenario."""
+    environ = EnvironBuilder(path = path, base_url = "http://example.org/").get_environ()
+    status, headers = call_app(app, environ)
+    cookies = [v.split(";")[0] for k, v in headers if k.lower() == "set-cookie"]
+    if cookies:
+        environ['HTTP_COOKIE'] = "; ".join(cookies)
+        status, headers = call_app(app, environ)
+    if get_status_code(status) != expected_status:
+        raise ValueError("%s returned %s instead of %s" %(path, status, expected_status))
+    return environ
+
+def percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+def measure_allocations(app, environ, number):
+    """return the net allocations per request, i.e. what is still allocated after
+    the requests have been processed. With ``tracemalloc`` these are bytes, otherwise
+    the number of objects tracked by the garbage collector (which is disabled while
+    measuring so that reference cycles created by a request are counted as well)."""
+    if tracemalloc is not None:
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        for i in range(number):
+            call_app(app, environ)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        return "bytes", (after - before) / float(number)
+    gc.collect()
+    gc.disable()
+    try:
+        before = len(gc.get_objects())
+        for i in range(number):
+            call_app(app, environ)
+        after = len(gc.get_objects())
+    finally:
+        gc.enable()
+    return "objects", (after - before) / float(number)
+
+def run_scenario(app, path, expected_status, number, warmup = 100):
+    """run a scenario and return its statistics"""
+    environ = create_environ(app, path, expected_status)
+    for i in range(warmup):
+        call_app(app, environ)
+
+    latencies = []
+    start = timer()
+    for i in range(number):
+        t = timer()
+        call_app(app, environ)
+        latencies.append(timer() - t)
+    total = timer() - start
+    latencies.sort()
+
+    unit, allocations = measure_allocations(app, environ, min(number, 1000))
+    return {
+        'rps'           : number / total,
+        'p50'           : percentile(latencies, 50) * 1000,
+        'p95'           : percentile(latencies, 95) * 1000,
+        'p99'           : percentile(latencies, 99) * 1000,
+        'allocations'   : allocations,
+        'allocation_unit' : unit,
+    }
+
+def compare(results, baseline, threshold):
+    """compare the results with a baseline and return the list of regressions"""
+    regressions = []
+    for name, stats in sorted(results.items()):
+        base = baseline.get(name)
+        if base is None:
+            continue
+        change = stats['rps'] / base['rps'] - 1
+        flag = ""
+        if change < -threshold:
+            flag = "REGRESSION"
+            regressions.append(name)
+        print "%-10s %10.0f %10.0f %+8.1f%% %s" %(name, base['rps'], stats['rps'], change * 100, flag)
+    return regressions
+
+def main(args = None):
+    parser = argparse.ArgumentParser(description = "benchmark the starflyer request pipeline")
+    parser.add_argument("-n", "--number", type = int, default = 2000, help = "requests per scenario")
+    parser.add_argument("-m", "--modules", type = int, default = 5, help = "number of modules to load")
+    parser.add_argument("-s", "--scenario", action = "append", help = "only run these scenarios")
+    parser.add_argument("--save", metavar = "FILE", help = "save the results as baseline")
+    parser.add_argument("--compare", metavar = "FILE", help = "compare the results with a saved baseline")
+    parser.add_argument("--threshold", type = float, default = 0.1,
+        help = "relative slowdown in requests/sec which counts as regression (default 0.1)")
+    args = parser.parse_args(args)
+
+    app = create_app(args.modules)
+    results = {}
+    print "%-10s %10s %8s %8s %8s %12s" %("scenario", "req/s", "p50 ms", "p95 ms", "p99 ms", "alloc/req")
+    for name, path, expected_status in scenarios:
+        if args.scenario and name not in args.scenario:
+            continue
+        try:
+            stats = results[name] = run_scenario(app, path, expected_status, args.number)
+        except ValueError, e:
+            print >>sys.stderr, "scenario %s is broken: %s" %(name, e)
+            return 2
+        print "%-10s %10.0f %8.3f %8.3f %8.3f %12.1f %s" %(name, stats['rps'],
+            stats['p50'], stats['p95'], stats['p99'], stats['allocations'], stats['allocation_unit'])
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent = 2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print
+        print "%-10s %10s %10s %9s" %("scenario", "baseline", "current", "change")
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -27,5 +27,7 @@ setup(name='starflyer',
       entry_points="""
       [console_scripts]
       server = starflyer.scripts:run
+      compile_templates = starflyer.scripts:compile_templates
+      build_static_manifest = starflyer.scripts:build_static_manifest
       """,
       )
@@ -4,6 +4,7 @@ import datetime
 import copy
 import os
 import sys
+import threading
 
 import logbook
 import wrappers
@@ -19,8 +20,12 @@ from werkzeug.test import Client, EnvironBuilder
 import sessions
 import static
 import exceptions
-from helpers import AttributeMapper, URL, fix_types
+from helpers import AttributeMapper, URL, fix_types, is_overridden, is_compressible, gzip_iter
+from modules import Module
 from templating import DispatchingJinjaLoader
+from routing import Dispatch, MatchCache
+from timing import RequestTimer, TimingStats
+from profiling import Profiler
 from ConfigParser import ConfigParser
 
 class Application(object):
@@ -49,6 +54,21 @@ class Application(object):
     # last handler for testing
     last_handler = None
 
+    # cache for url matching results (see ``url_match_cache_size``)
+    match_cache = None
+
+    # the manifest of fingerprinted static files (see ``static_fingerprint``)
+    static_manifest = None
+
+    # in-memory cache for static files (see ``static_memory_cache_size``)
+    static_cache = None
+
+    # statistics about the durations of request phases (see ``request_timing``)
+    timing = None
+
+    # the profiler for handlers (see ``profiling``)
+    profiler = None
+
     # enforeced defaults (these have to be existent in the config
     # for starflyer to work (DO NOT CHANGE!)
     enforced_defaults = {
@@ -59,6 +79,7 @@ class Application(object):
         'session_cookie_path'           : None,
         'session_cookie_httponly'       : True,
         'session_cookie_secure'         : False,
+        'session_refresh_each_request'  : False, # True = re-send permanent session cookies on each request to extend their lifetime
         'logger_name'                   : None,
         'server_name'                   : None,
         'application_root'              : None,
@@ -68,10 +89,34 @@ class Application(object):
         'testing'                       : False,
         'force_exceptions'              : False, # True = make also http exceptions raise and not return a response (for testing)
         'static_cache_timeout'          : 12 * 60 * 60,
+        'static_offload'                : None, # None, "x-sendfile" or "x-accel-redirect" to let a front proxy send static files
+        'static_accel_redirect_prefix'  : "", # prefix of the internal location for X-Accel-Redirect aliasing the static folder, the quoted file path relative to it is appended
+        'static_fingerprint'            : False, # True = generate static URLs containing a hash of the file content
+        'static_manifest_file'          : None, # JSON file with a prebuilt static manifest, built on startup if missing
+        'static_fingerprint_max_age'    : 365 * 24 * 60 * 60, # cache timeout for fingerprinted static URLs
+        'static_precompressed'          : False, # True = serve .br and .gz files next to static files if accepted
+        'static_compress_cache_dir'     : None, # directory for gzipped versions of static files created on demand
+        'static_compress_min_size'      : 1024, # minimum size of static files to be gzipped on demand
+        'static_memory_cache_size'      : 0, # number of bytes of static files to keep in memory, 0 = disabled
+        'static_memory_cache_max_file_size' : 64 * 1024, # only files up to this size are kept in memory
+        'static_memory_cache_check_interval' : 2, # seconds after which cached static files are checked for changes
+        'compress_responses'            : False, # True = gzip compressible responses if the client accepts it
+        'compress_min_size'             : 500, # minimum size of a response body to be compressed
+        'compress_level'                : 6, # gzip compression level from 1 to 9
         'template_folder'               : "templates/",
         'static_folder'                 : "static/",
         'static_url_path'               : "/static",
         'modules'                       : AttributeMapper(), # config placeholder for modules
+        'cache_logger'                  : True, # build the log setup only once and reuse it for all requests
+        'url_match_cache_size'          : 0, # number of url matches to cache, 0 = disabled
+        'shared_template_globals'       : False, # True = do not pass globals on each render but only use the environment globals
+        'template_bytecode_cache_dir'   : None, # directory for storing compiled templates, None = no bytecode cache
+        'template_stream_buffer_size'   : 5, # number of template parts to send at once with ``Handler.render_stream()``, 0 or 1 = unbuffered
+        'request_timing'                : False, # True = measure the phases of each request, see ``starflyer.timing``
+        'request_timing_header'         : False, # True = send the measured durations in a Server-Timing header
+        'request_timing_samples'        : 1000, # number of durations to keep per endpoint and phase
+        'profiling'                     : False, # True = create a profiler which can be armed for endpoints, see ``starflyer.profiling``
+        'profiling_dir'                 : None, # directory to write the profiling results of each endpoint to
     }
 
     # here you can define which types the config parameters are supposed to be in 
@@ -80,6 +125,24 @@ class Application(object):
         'testing' : bool,
         'session_cookie_httponly' : bool,
         'session_cookie_secure' : bool,
+        'session_refresh_each_request' : bool,
+        'cache_logger' : bool,
+        'url_match_cache_size' : int,
+        'shared_template_globals' : bool,
+        'template_stream_buffer_size' : int,
+        'static_fingerprint' : bool,
+        'static_precompressed' : bool,
+        'static_compress_min_size' : int,
+        'static_memory_cache_size' : int,
+        'static_memory_cache_max_file_size' : int,
+        'static_memory_cache_check_interval' : int,
+        'compress_responses' : bool,
+        'compress_min_size' : int,
+        'compress_level' : int,
+        'request_timing' : bool,
+        'request_timing_header' : bool,
+        'request_timing_samples' : int,
+        'profiling' : bool,
     }
 
     jinja_options = ImmutableDict(
@@ -91,6 +154,12 @@ class Application(object):
     modules = [] # list of modules
     module_map = AttributeMapper() # mapped version of modules
 
+    # chains of the module and app hooks which are actually implemented
+    # (computed by ``rebuild_hook_chains()``)
+    before_handler_hooks = []
+    after_handler_hooks = []
+    render_context_hooks = []
+
     def __init__(self, import_name, config={}, **kw):
         """initialize the Application 
 
@@ -103,6 +172,10 @@ class Application(object):
         # initialize URL mapping variables
         self.url_map = werkzeug.routing.Map()
         self.handlers = {}
+        self._dispatch_compiled = False
+
+        # holds the request currently processed in this thread for the log record injection
+        self._log_context = threading.local()
 
        
         # initialize configuration
@@ -131,6 +204,24 @@ class Application(object):
         self.config.update(fix_types(kw, self.config_types))
         # TODO: update from environment vars?
         
+        # create the url match cache if configured
+        if self.config.url_match_cache_size:
+            self.match_cache = MatchCache(self.config.url_match_cache_size)
+
+        # create the in-memory cache for static files if configured
+        if self.config.static_memory_cache_size:
+            self.static_cache = static.StaticFileCache(
+                self.config.static_memory_cache_size,
+                self.config.static_memory_cache_check_interval)
+
+        # collect request timings if configured
+        if self.config.request_timing:
+            self.timing = TimingStats(self.config.request_timing_samples)
+
+        # create the profiler if configured
+        if self.config.profiling:
+            self.profiler = Profiler(self.config.profiling_dir)
+
         self.finalize_modules() # let user dynamically add some modules
 
         # now bind all the modules to our app and create a mapping 
@@ -162,6 +253,19 @@ class Application(object):
         # now call the hook for changing the setup after initialization
         self.finalize_setup()
 
+        # precompute the dispatch records for all the rules
+        self.compile_dispatch()
+
+        # only call those hooks which are actually implemented
+        self.rebuild_hook_chains()
+
+        # load or compute the fingerprinted static filenames
+        if self.config.static_fingerprint:
+            self.static_manifest = self.create_static_manifest()
+
+        # create the WSGI entry point with the request independent settings baked in
+        self.wsgi_app = self.compile_wsgi_app()
+
         # for testing purposes. Set app.config.testing = True and this will be populated.
         self.last_handler = None
 
@@ -224,6 +328,51 @@ class Application(object):
         """
         return response
 
+    def compress_response(self, request, response):
+        """gzip the response if it's compressible and the client accepts it. This is called
+        after :meth:`finalize_response` in case ``compress_responses`` is enabled.
+
+        Responses in direct passthrough mode (like static files), already encoded responses,
+        responses without a body and responses of a mimetype not worth compressing are left
+        untouched. Buffered bodies are only compressed if they are at least
+        ``compress_min_size`` bytes long, streamed bodies are compressed while streaming.
+
+        :param request: the request the response is for
+        :param response: the response to compress
+        :returns: the response
+        """
+        if not isinstance(response, werkzeug.wrappers.BaseResponse) \
+            or response.direct_passthrough \
+            or 'Content-Encoding' in response.headers \
+            or response.status_code < 200 or response.status_code in (204, 206, 304) \
+            or request.method == "HEAD":
+            return response
+        mimetype = response.mimetype
+        if not mimetype or not is_compressible(mimetype):
+            return response
+
+        # the response depends on the Accept-Encoding header from here on
+        response.vary.add("Accept-Encoding")
+        if not request.accept_encodings.quality("gzip"):
+            return response
+
+        level = self.config.compress_level
+        if response.is_sequence:
+            data = response.get_data()
+            if len(data) < self.config.compress_min_size:
+                return response
+            response.set_data("".join(gzip_iter([data], level)))
+        else:
+            response.response = gzip_iter(response.iter_encoded(), level)
+            response.headers.pop('Content-Length', None)
+        response.headers['Content-Encoding'] = "gzip"
+
+        # the compressed representation needs it's own etag
+        etag, weak = response.get_etag()
+        if etag is not None:
+            response.set_etag(etag+"-gzip", weak)
+        return response
+
     def finalize_setup(self):
         """a hook you can use to finalize the setup. You can add new routes, change configuration
         values etc.
@@ -233,6 +382,37 @@ class Application(object):
         """a hook you can use to add modules to the modules list more dynamically and while using the app's config for it. Simply add them to the ``self.modules`` list via ``append()``.
         """
 
+    def rebuild_hook_chains(self):
+        """collect the ``before_handler``, ``after_handler`` and ``get_render_context`` hooks
+        of all modules and the app which are actually overridden. Modules only using the empty
+        default implementations are skipped that way.
+
+        This is called at the end of the initialization. If you add modules later
+        you need to call it again.
+        """
+        before_handler_hooks = []
+        after_handler_hooks = []
+        render_context_hooks = []
+        for module in self.modules:
+            if is_overridden(module, Module, "before_handler"):
+                before_handler_hooks.append(module.before_handler)
+            if is_overridden(module, Module, "after_handler"):
+                after_handler_hooks.append(module.after_handler)
+            if is_overridden(module, Module, "get_render_context"):
+                render_context_hooks.append(module.get_render_context)
+
+        # the app hooks always come last
+        if is_overridden(self, Application, "before_handler"):
+            before_handler_hooks.append(self.before_handler)
+        if is_overridden(self, Application, "after_handler"):
+            after_handler_hooks.append(self.after_handler)
+        if is_overridden(self, Application, "get_render_context"):
+            render_context_hooks.append(self.get_render_context)
+
+        self.before_handler_hooks = before_handler_hooks
+        self.after_handler_hooks = after_handler_hooks
+        self.render_context_hooks = render_context_hooks
+
     ####
     #### handler related hooks you can override
     ####
@@ -285,12 +465,52 @@ class Application(object):
             options['loader'] = self.global_jinja_loader
         #if 'autoescape' not in options:
             #options['autoescape'] = self.select_jinja_autoescape
+        if 'bytecode_cache' not in options and self.config.template_bytecode_cache_dir is not None:
+            cache_dir = self.config.template_bytecode_cache_dir
+            if not os.path.exists(cache_dir):
+                os.makedirs(cache_dir)
+            options['bytecode_cache'] = jinja2.FileSystemBytecodeCache(cache_dir)
         rv = jinja2.Environment(**options)
         for name, flt in self.jinja_filters.items():
             rv.filters[name] = flt
+
+        # app wide globals are registered only once
+        rv.globals['M'] = self.module_map
         return rv
+
+    def compile_templates(self):
+        """load all templates of the app and the modules once so that they get compiled.
+        If a bytecode cache is configured via ``template_bytecode_cache_dir`` the compiled
+        templates are stored in there and new processes do not need to compile them again.
+
+        :returns: a tuple of the list of template names and a dictionary mapping the names
+            of templates which could not be compiled to the exception raised.
+        """
+        env = self.jinja_env
+        names = sorted(env.list_templates())
+        errors = {}
+        for name in names:
+            try:
+                env.get_template(name)
+            except Exception, e:
+                errors[name] = e
+        return names, errors
         
 
+    ####
+    #### STATIC FILES
+    ####
+
+    def create_static_manifest(self):
+        """create the :class:`~starflyer.static.StaticManifest` for fingerprinted static URLs.
+        If ``static_manifest_file`` is configured and exists it will be loaded from there,
+        otherwise all the static files of the app and the modules are hashed now.
+        """
+        filename = self.config.static_manifest_file
+        if filename is not None and os.path.exists(filename):
+            return static.StaticManifest.load(filename)
+        return static.StaticManifest.from_app(self)
+
     ####
     #### SESSION related
     #### (directly copied from flask)
@@ -353,6 +573,49 @@ class Application(object):
         if handler is not None:
             self.handlers[endpoint] = handler
 
+        # rules added after the setup is finished need to be compiled directly. If the
+        # handler of an existing endpoint was replaced all it's rules need to be updated
+        if self._dispatch_compiled:
+            if handler is not None:
+                for r in self.url_map.iter_rules(endpoint):
+                    self.compile_rule(r)
+            else:
+                self.compile_rule(rule)
+
+        # cached matches might be wrong now
+        if self.match_cache is not None:
+            self.match_cache.clear()
+
+    def compile_rule(self, rule):
+        """compute the dispatch record for a rule and attach it to the rule as ``dispatch``.
+
+        :param rule: the url rule to compile
+        :returns: the :class:`~starflyer.routing.Dispatch` instance or ``None`` if no
+            handler is registered for the rule's endpoint
+        """
+        handler = self.handlers.get(rule.endpoint, None)
+        if handler is None:
+            rule.dispatch = None
+            return None
+
+        # check if the rule belongs to a module
+        module = None
+        parts = rule.endpoint.split(".")
+        if len(parts)==2:
+            module = self.module_map.get(parts[0], None)
+
+        rule.dispatch = Dispatch(handler, module)
+        return rule.dispatch
+
+    def compile_dispatch(self):
+        """compute the dispatch records for all rules in the url map. This is done at the
+        end of the initialization so that matching a rule directly yields the handler
+        class and module to use.
+        """
+        for rule in self.url_map.iter_rules():
+            self.compile_rule(rule)
+        self._dispatch_compiled = True
+
 
     ####
     #### request processing
@@ -384,26 +647,38 @@ class Application(object):
 
         # create the url adapter
         urls = self.create_url_adapter(request)
-
-        try:
-            url_rule, request.view_args = urls.match(return_rule=True)
-            request.url_rule = url_rule
-            request.url_adapter = urls
-        except werkzeug.exceptions.HTTPException, e:
-            # this basically means 404 but maybe some debugging can occur
-            # this is reraised then though
-            self.raise_routing_exception(request, e)
-
-        # check if we are called from a module
-        module = None
-        endpoint = url_rule.endpoint
-        parts = endpoint.split(".")
-        if len(parts)==2:
-            module_name = parts[0]
-            module = self.module_map.get(module_name, None)
-
-        # try to find the right handler for this url and instantiate it
-        return self.handlers[url_rule.endpoint](self, request, module = module)
+        request.url_adapter = urls
+
+        # check the url match cache first if enabled
+        cache = self.match_cache
+        match = None
+        if cache is not None:
+            key = (urls.server_name, urls.subdomain, urls.script_name, urls.default_method, urls.path_info)
+            match = cache.get(key)
+
+        if match is None:
+            try:
+                match = urls.match(return_rule=True)
+            except werkzeug.exceptions.HTTPException, e:
+                # this basically means 404 but maybe some debugging can occur
+                # this is reraised then though
+                self.raise_routing_exception(request, e)
+            if cache is not None:
+                cache.set(key, match)
+
+        url_rule, view_args = match
+        request.url_rule = url_rule
+        request.view_args = dict(view_args) # copy it as the cached version might be shared
+
+        # use the precomputed dispatch record and compile it in case it's missing
+        dispatch = getattr(url_rule, "dispatch", None)
+        if dispatch is None:
+            dispatch = self.compile_rule(url_rule)
+            if dispatch is None:
+                raise KeyError(url_rule.endpoint)
+
+        # instantiate the handler for this url
+        return dispatch.handler(self, request, module = dispatch.module)
 
 
     def process_request(self, request):
@@ -413,71 +688,132 @@ class Application(object):
         """
         handler = None
 
+        # time the request phases if enabled
+        timer = None
+        if self.timing is not None:
+            timer = request.timer = RequestTimer()
+
         # check if we are the first request ever for this application
         self.check_first_request(request)
 
-        # helper for injecting data into the log record
-        def inject(record):
-            """the injection callback for any log record"""
-            record.extra['url'] = request.url
-            record.extra['method'] = request.method
-            record.extra['ip'] = request.remote_addr
-            record.hid = id(request)
-            # TODO: add a hook for adding more information
-            
         # use the log context to actually call the handler
-        with self.setup_logger():
-            with logbook.Processor(inject):
+        if self.config.cache_logger:
+            log_setup = self.log_setup
+        else:
+            log_setup = self.create_log_setup()
+        previous_request = getattr(self._log_context, "request", None)
+        self._log_context.request = request
+        try:
+            with log_setup:
                 try:
                     # find the handler 
                     handler = self.find_handler(request)
+                    if timer is not None:
+                        timer.mark("routing")
 
                     # run the before_handler hooks from app and modules
                     if handler.use_hooks:
-                        for module in self.modules:
-                            rv = module.before_handler(handler)
+                        for hook in self.before_handler_hooks:
+                            rv = hook(handler)
                             if rv is not None:
                                 return rv
-                        rv = self.before_handler(handler)
-                        if rv is not None:
-                            return rv
+                        if timer is not None:
+                            timer.mark("before_handler")
 
                     # in case we are in testing mode remember the last used handler
                     if self.config.testing:
                         self.last_handler = handler
 
                     # call the handler and receive the response
-                    response = handler(**request.view_args)
+                    profiler = self.profiler
+                    if profiler is not None and profiler.armed and profiler.should_profile(request.endpoint):
+                        response = profiler.runcall(request.endpoint, handler, **request.view_args)
+                    else:
+                        response = handler(**request.view_args)
+                    if timer is not None:
+                        timer.mark("handler")
                     if handler.use_hooks:
-                        for module in self.modules:
-                            rv = module.after_handler(handler, response) # hook for post processing a resposne
+                        for hook in self.after_handler_hooks:
+                            rv = hook(handler, response) # hook for post processing a resposne
                             if rv is not None:
                                 return rv
-                        rv = self.after_handler(handler, response) # hook for post processing a resposne
-                        if rv is not None:
-                            return rv
+                        if timer is not None:
+                            timer.mark("after_handler")
 
                 except Exception, e:
                     response = self.handle_user_exception(request, e)
+                    if timer is not None:
+                        timer.mark("error")
 
                 # now save the session after the after handlers might have changed it
-                if handler and not self.session_interface.is_null_session(handler.session):
-                    self.save_session(handler.session, response)
+                # but only if it has been loaded and modified at all
+                if handler is not None and handler.session_loaded:
+                    session = handler.session
+                    if not self.session_interface.is_null_session(session) \
+                            and self.session_interface.should_save_session(self, session):
+                        self.save_session(session, response)
+                        if timer is not None:
+                            timer.mark("session_save")
+        finally:
+            self._log_context.request = previous_request
+
+        response = self.finalize_response(response) # hook for post processing a resposne
+        if self.config.compress_responses:
+            response = self.compress_response(request, response)
+        if timer is not None:
+            timer.mark("finalize")
+            self.record_timing(request, response, timer)
+        return response
 
-        return self.finalize_response(response) # hook for post processing a resposne
+    def record_timing(self, request, response, timer):
+        """store the durations measured by ``timer`` in :attr:`timing` and add
+        the ``Server-Timing`` header if configured. Override this to send the
+        timings somewhere else.
+        """
+        self.timing.record(request.endpoint, timer)
+        if self.config.request_timing_header and hasattr(response, "headers"):
+            response.headers['Server-Timing'] = timer.server_timing()
 
     
+    def compile_wsgi_app(self):
+        """return the WSGI application which is called for each request. The number
+        of path segments to shift (``shift_path_info``), the request class and
+        :meth:`process_request` are looked up only once here. Call this again and
+        store the result in :attr:`wsgi_app` if you change one of them later.
+
+        Exception handling is not precompiled as ``propagate_exceptions`` might be
+        changed at runtime and only matters if an exception actually happens.
+
+        You can pass :attr:`wsgi_app` instead of the app to your WSGI server
+        to save one function call per request.
+        """
+        spi = int(self.config.get("shift_path_info", 0))
+        request_class = self.request_class
+        process_request = self.process_request
+
+        if spi:
+            def wsgi_app(environ, start_response):
+                for i in xrange(spi):
+                    shift_path_info(environ)
+                request = request_class(environ)
+                try:
+                    response = process_request(request)
+                except Exception, e:
+                    response = self.handle_exception(request, e)
+                return response(environ, start_response)
+        else:
+            def wsgi_app(environ, start_response):
+                request = request_class(environ)
+                try:
+                    response = process_request(request)
+                except Exception, e:
+                    response = self.handle_exception(request, e)
+                return response(environ, start_response)
+        return wsgi_app
+
     def __call__(self, environ, start_response):
         """do WSGI request dispatching"""
-        spi = int(self.config.get("shift_path_info", 0))
-        for i in range(0,spi):
-            shift_path_info(environ)
-        request = self.request_class(environ)
-        try:
-            response = self.process_request(request)
-        except Exception, e:    
-            response = self.handle_exception(request, e)
-        return response(environ, start_response)
+        return self.wsgi_app(environ, start_response)
         
 
     def setup_logger(self):
@@ -498,6 +834,40 @@ class Application(object):
         # our default formatting
         return handler
 
+    def create_log_setup(self):
+        """create the complete log setup for processing requests. This consists of the
+        handlers returned by :meth:`setup_logger` and a processor which injects the
+        request related data via :meth:`inject_log_record`.
+
+        :returns: a ``NestedSetup`` object to be used as context manager
+        """
+        return logbook.NestedSetup([
+            self.setup_logger(),
+            logbook.Processor(self.inject_log_record),
+        ])
+
+    @werkzeug.cached_property
+    def log_setup(self):
+        """the log setup which is used for all requests in case ``cache_logger`` is
+        enabled. It is only created once on first access and then reused.
+        """
+        return self.create_log_setup()
+
+    def inject_log_record(self, record):
+        """the injection callback for any log record. It adds information about the
+        request currently processed in this thread. Override this method if you want to
+        add more information to the log record.
+
+        :param record: the ``LogRecord`` to be processed
+        """
+        request = getattr(self._log_context, "request", None)
+        if request is None:
+            return
+        record.extra['url'] = request.url
+        record.extra['method'] = request.method
+        record.extra['ip'] = request.remote_addr
+        record.hid = id(request)
+
 
     ####
     #### exception handling (mostly taken from flask)
@@ -667,6 +1037,8 @@ class Application(object):
     def url_for(self, endpoint = None,  _full = False, _append=False, request = None, **kwargs):
         """return a URL generated from the mapper"""
         adapter = self.create_url_adapter(request)
+        if self.static_manifest is not None:
+            kwargs = self.static_manifest.url_values(endpoint, kwargs)
         return adapter.build(
                 endpoint, 
                 kwargs, 
@@ -1,6 +1,13 @@
+import sys
+import time
+import atexit
+import weakref
+import threading
+import traceback
+import Queue
 from logbook import Handler, NOTSET, lookup_level
 
-__all__ = ['MongoHandler']
+__all__ = ['MongoHandler', 'BufferedMongoHandler']
 
 class MongoHandler(Handler):
     """log to a mongoDB database """
@@ -23,3 +30,163 @@ class MongoHandler(Handler):
         """store the record in the database"""
         self.collection.insert(record.to_dict())
 
+
+# markers put into the queue to stop the writer thread and to write the current batch
+_STOP = object()
+_FLUSH = object()
+
+# the open buffered handlers which are closed on interpreter shutdown
+_open_handlers = weakref.WeakSet()
+
+@atexit.register
+def _close_open_handlers():
+    for handler in list(_open_handlers):
+        handler.close()
+
+
+class BufferedMongoHandler(MongoHandler):
+    """log to a mongoDB database from a background thread. Records are put into a
+    bounded queue and written in bulk once ``batch_size`` records are waiting or
+    ``flush_interval`` seconds have passed. This way a slow database does not
+    slow down requests.
+
+    If the queue is full the ``overflow`` policy decides what happens:
+
+    * ``drop_new`` drops the new record (the default)
+    * ``drop_oldest`` drops the oldest waiting record
+    * ``block`` waits until there is room in the queue again
+
+    The number of dropped records is available as ``dropped``. Waiting records are
+    written when :meth:`close` is called which also happens on interpreter shutdown.
+    The writer thread only keeps a weak reference to the handler so that it stops
+    once the handler is not used anymore.
+    """
+
+    overflow_policies = ("drop_new", "drop_oldest", "block")
+
+    # seconds to wait for the writer thread when closing the handler
+    close_timeout = 5
+
+    def __init__(self, collection, level=NOTSET, filter = None, bubble=False,
+                 batch_size = 100, flush_interval = 1.0, max_queue_size = 10000,
+                 overflow = "drop_new"):
+        """initialize with a mongodb collection
+
+        :param collection: The MongoDB ``Collection`` object to log to.
+        :param level: The level we log for
+        :param filter: A filter to use
+        :param bubble: defines if the log entry should bubble up
+        :param batch_size: the maximum number of records to write at once
+        :param flush_interval: the maximum number of seconds records wait in the queue
+        :param max_queue_size: the maximum number of records waiting to be written
+        :param overflow: what to do if the queue is full, see above
+
+        """
+        super(BufferedMongoHandler, self).__init__(collection, level, filter, bubble)
+        if overflow not in self.overflow_policies:
+            raise ValueError("unknown overflow policy %r" %overflow)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.dropped = 0
+        self.queue = Queue.Queue(max_queue_size)
+        self._closed = False
+        self._thread = threading.Thread(target = _write_records, name = "BufferedMongoHandler",
+            args = (weakref.ref(self), self.queue, batch_size, flush_interval))
+        self._thread.daemon = True
+        self._thread.start()
+        _open_handlers.add(self)
+
+    def emit(self, record):
+        """put the record into the queue. It is converted on the calling thread because
+        some of its information is only available there."""
+        doc = record.to_dict()
+        if self._closed:
+            self.write([doc])
+            return
+        if self.overflow == "block":
+            self.queue.put(doc)
+            return
+        try:
+            self.queue.put_nowait(doc)
+        except Queue.Full:
+            self.dropped += 1
+            if self.overflow == "drop_oldest":
+                try:
+                    self.queue.get_nowait()
+                    self.queue.task_done()
+                    self.queue.put_nowait(doc)
+                except (Queue.Empty, Queue.Full):
+                    pass
+
+    def flush(self):
+        """write all waiting records now and wait until this is done"""
+        if self._closed or not self._thread.is_alive():
+            return
+        self.queue.put(_FLUSH)
+        self.queue.join()
+
+    def close(self):
+        """write the waiting records and stop the background thread"""
+        if self._closed:
+            return
+        self._closed = True
+        _open_handlers.discard(self)
+        if not self._thread.is_alive():
+            return
+        try:
+            self.queue.put(_STOP, timeout = self.close_timeout)
+        except Queue.Full:
+            return # the writer thread does not make any progress
+        self._thread.join(self.close_timeout)
+
+    def write(self, docs):
+        """write a list of records to the database"""
+        insert_many = getattr(self.collection, "insert_many", None)
+        if insert_many is not None:
+            insert_many(docs)
+        else:
+            self.collection.insert(docs)
+
+
+def _get_batch(queue, batch_size, flush_interval):
+    """return the next records to write and whether the writer thread should stop"""
+    batch = []
+    try:
+        item = queue.get(True, flush_interval)
+    except Queue.Empty:
+        return batch, False
+    deadline = time.time() + flush_interval
+    while item is not _STOP and item is not _FLUSH:
+        batch.append(item)
+        if len(batch) >= batch_size:
+            return batch, False
+        timeout = deadline - time.time()
+        if timeout <= 0:
+            return batch, False
+        try:
+            item = queue.get(True, timeout)
+        except Queue.Empty:
+            return batch, False
+    # the marker is done once the batch is written
+    batch.append(item)
+    return batch, item is _STOP
+
+def _write_records(handler_ref, queue, batch_size, flush_interval):
+    """the writer thread of a :class:`BufferedMongoHandler`. It stops when the handler
+    is closed or has been garbage collected."""
+    stop = False
+    while not stop:
+        batch, stop = _get_batch(queue, batch_size, flush_interval)
+        docs = [doc for doc in batch if doc is not _STOP and doc is not _FLUSH]
+        handler = handler_ref()
+        if handler is None:
+            stop = True
+        elif docs:
+            try:
+                handler.write(docs)
+            except Exception:
+                traceback.print_exc(file = sys.stderr)
+        del handler
+        for i in range(len(batch)):
+            queue.task_done()
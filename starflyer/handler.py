@@ -1,11 +1,16 @@
 import os
 import copy
 import json
+import types
+import jinja2
 import werkzeug.exceptions
 import exceptions
 import datetime
+import time
 import starflyer
 import sessions
+from werkzeug.local import LocalProxy
+from werkzeug.utils import cached_property
 
 class Handler(object):
     """a request handler which is also the base class for an application"""
@@ -29,13 +34,41 @@ class Handler(object):
         self.config = app.config
         self.url_adapter = request.url_adapter
         self.flashes = None
-        self.session = None
 
-        # retrieve a session if available
-        self.session = self.app.open_session(self.request)
-        if self.session is None:
-            self.session = self.app.make_null_session()
+        # the session is only opened on first access, see ``session``
         # note that session saving is happening in the app as some hooks could run before that 
+        self._session = None
+
+    ####
+    #### session handling
+    ####
+
+    def _get_session(self):
+        """return the session and open it in case this did not happen yet"""
+        if self._session is None:
+            timer = getattr(self.request, "timer", None)
+            if timer is not None:
+                start = time.time()
+            session = self.app.open_session(self.request)
+            if session is None:
+                session = self.app.make_null_session()
+            self._session = session
+            if timer is not None:
+                timer.add("session_open", time.time() - start)
+        return self._session
+
+    def _set_session(self, session):
+        self._session = session
+
+    #: the session of this request. It is loaded lazily on first access so that
+    #: handlers not using it do not need to pay for decoding the session cookie.
+    session = property(_get_session, _set_session)
+    del _get_session, _set_session
+
+    @property
+    def session_loaded(self):
+        """return ``True`` if the session has been opened for this handler"""
+        return self._session is not None
 
     ####
     #### before and after request hooks
@@ -142,6 +175,8 @@ class Handler(object):
                 endpoint = "%s.%s" %(self.module.name, endpoint[1:])
             else:
                 endpoint = endpoint[1:] # remove dot if module not found
+        if self.app.static_manifest is not None:
+            kwargs = self.app.static_manifest.url_values(endpoint, kwargs)
         return self.request.url_adapter.build(
                 endpoint, 
                 kwargs, 
@@ -162,16 +197,35 @@ class Handler(object):
         return dict(
             handler = self,
             request = self.request,
-            session = self.session,
+            session = LocalProxy(lambda: self.session), # only load the session if the template uses it
             url_for = self.url_for,
             config = self.config,
             get_flashes = self.get_flashes,
             gettext = lambda x: x                   # dummy i18n handler for jinja2
         )
 
+    @cached_property
+    def base_render_context(self):
+        """the render context which is shared by all templates rendered by this handler.
+        It consists of the ``default_render_context`` updated by the render contexts of
+        the modules and the app and is only computed once per handler instance and thus
+        per request.
+        """
+        params = starflyer.AttributeMapper(self.default_render_context)
+        for hook in self.app.render_context_hooks:
+            params.update(hook(self))
+        return params
+
     @property
     def template_globals(self):
-        """return global variables to be used inside a template. Note that these are cached!"""
+        """return global variables to be used inside a template. Note that these are cached!
+
+        If ``shared_template_globals`` is enabled these are not used. In this case only the
+        globals of the jinja environment are used (which contain ``M``) and ``url_for`` is
+        only available via the render context. Templates can then be reused across requests
+        without updating their globals. Note that macros imported without context won't see
+        ``url_for`` then.
+        """
         return dict(
             url_for = self.url_for,
             M = self.app.module_map
@@ -185,28 +239,62 @@ class Handler(object):
         return dict()
 
 
-    def render(self, tmplname=None, **kwargs):
-        """render a template. If the ``tmplname`` is given, it will render
-        this template otherwise take the default ``self.template``. You can
-        pass in kwargs which are then passed to the template on rendering."""
+    def get_template(self, tmplname=None):
+        """return the template to render. If the ``tmplname`` is not given
+        ``self.template`` is used. If we are called from a module the template
+        is looked up relative to the module's templates."""
         if tmplname is None:
             tmplname = self.template
 
-        params = starflyer.AttributeMapper(self.default_render_context)
-        for module in self.app.modules:
-            params.update(module.get_render_context(self))
-        params.update(self.app.get_render_context(self))
-        params.update(self.render_context)
-        params.update(kwargs)
+        # per render globals are only passed if not shared via the environment
+        if self.config.shared_template_globals:
+            template_globals = None
+        else:
+            template_globals = self.template_globals
 
         # if we are called from a module, we try the module prefix for loading the template
         if self.module is not None:
             # construct relative path which also allows for .. and /
-            path = os.path.normpath(os.path.join("_m", self.module.name, tmplname))
-            tmpl = self.app.jinja_env.get_or_select_template(path, globals = self.template_globals)
-        else:
-            tmpl = self.app.jinja_env.get_or_select_template(tmplname, globals = self.template_globals)
-        return tmpl.render(**params)
+            tmplname = os.path.normpath(os.path.join("_m", self.module.name, tmplname))
+        return self.app.jinja_env.get_or_select_template(tmplname, globals = template_globals)
+
+    def get_render_params(self, kwargs):
+        """return the parameters for rendering a template which are the base render
+        context, the handler's :meth:`render_context` and the given ``kwargs``"""
+        # copy the base context and add the handler specific parameters
+        params = starflyer.AttributeMapper()
+        dict.update(params, self.base_render_context)
+        params.fast_update(self.render_context)
+        params.fast_update(kwargs)
+        return params
+
+    def render(self, tmplname=None, **kwargs):
+        """render a template. If the ``tmplname`` is given, it will render
+        this template otherwise take the default ``self.template``. You can
+        pass in kwargs which are then passed to the template on rendering."""
+        tmpl = self.get_template(tmplname)
+        return tmpl.render(**self.get_render_params(kwargs))
+
+    def render_stream(self, tmplname=None, **kwargs):
+        """like :meth:`render` but return the template as a stream which is rendered
+        while the response is sent. Return it from your handler method to send
+        large pages without building them in memory first. The output is sent in
+        chunks of ``template_stream_buffer_size`` template parts (0 or 1 = send each
+        part on its own).
+
+        Note that the template is rendered after the handler has finished and the
+        session has been saved. Changes to the session while rendering are therefore
+        lost. This includes flash messages: calling ``get_flashes()`` in a streamed
+        template does not remove them, so call it in your handler and pass the messages
+        to the template instead. Exceptions while rendering are not handled by the
+        error handlers of the app either.
+        """
+        tmpl = self.get_template(tmplname)
+        stream = tmpl.stream(**self.get_render_params(kwargs))
+        size = self.config.template_stream_buffer_size
+        if size > 1: # jinja needs at least 2 parts for buffering
+            stream.enable_buffering(size)
+        return stream
 
     def __call__(self, **m):
         """handle a single request. This means checking the method to use,
@@ -249,6 +337,8 @@ class Handler(object):
                                 string encoded to utf-8 as body
         a WSGI function         the function is called as WSGI application
                                 and buffered as response object
+        a generator or          a streamed response object is created with
+        template stream         the generated strings as body
         :class:`tuple`          A tuple in the form ``(response, status,
                                 headers)`` where `response` is any of the
                                 types defined here, `status` is a string
@@ -274,6 +364,9 @@ class Handler(object):
             if isinstance(rv, basestring):
                 rv = self.app.response_class(rv, headers=headers, status=status)
                 headers = status = None
+            elif isinstance(rv, (types.GeneratorType, jinja2.environment.TemplateStream)):
+                rv = self.app.response_class(rv, headers=headers, status=status)
+                headers = status = None
             else:
                 rv = self.app.response_class.force_type(rv, self.request.environ)
 
@@ -1,4 +1,6 @@
 import types
+import copy
+import zlib
 
 # try to load the best simplejson implementation available.  If JSON
 # is not installed, we add a failing class.
@@ -124,6 +126,37 @@ class AttributeMapper(dict):
             else:
                 self[a] = v
 
+    def fast_update(self, d):
+        """a faster version of :meth:`update` for dictionaries like render contexts which
+        mostly contain plain values. These are set directly and only dotted keys and
+        dictionaries take the slow path via ``update()``. In that case all the sub
+        dictionaries which would be changed are copied first so that dictionaries this
+        one was copied from are not changed.
+        """
+        for a,v in d.iteritems():
+            if type(v) is not types.DictType and "." not in a:
+                self[a] = v
+                continue
+            _copy_for_update(self, a, v)
+            self.update({a: v})
+
+
+def _copy_for_update(container, key, value):
+    """replace the sub dictionaries of ``container`` which updating ``key`` (which might
+    be a dotted key) with ``value`` would change with shallow copies of them"""
+    if "." in key:
+        prefix, remainder = key.split(".", 1)
+        sub = container.get(prefix)
+        if isinstance(sub, dict):
+            sub = container[prefix] = copy.copy(sub)
+            _copy_for_update(sub, remainder, value)
+        return
+    sub = container.get(key)
+    if isinstance(sub, dict) and type(value) is types.DictType:
+        sub = container[key] = copy.copy(sub)
+        for k, v in value.iteritems():
+            _copy_for_update(sub, k, v)
+
 
 class URL(object):
     """proxy object for a URL rule in order to be used more easily in route listings"""
@@ -141,6 +174,53 @@ class URL(object):
         self.handler = handler
         self.options = options
 
+# mimetypes besides ``text/*`` which are worth compressing
+COMPRESSIBLE_MIMETYPES = frozenset([
+    'application/javascript',
+    'application/x-javascript',
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/rss+xml',
+    'application/atom+xml',
+    'image/svg+xml',
+    'image/x-icon',
+    'application/vnd.ms-fontobject',
+    'font/ttf',
+    'font/otf',
+])
+
+def is_compressible(mimetype):
+    """check if content of the given mimetype is worth compressing"""
+    return mimetype.startswith("text/") or mimetype in COMPRESSIBLE_MIMETYPES
+
+def gzip_iter(iterable, level = 6):
+    """compress the byte strings of ``iterable`` in gzip format and yield the compressed
+    chunks as they become available
+
+    :param iterable: an iterable of byte strings
+    :param level: the compression level from 1 to 9
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in iterable:
+        chunk = compressor.compress(chunk)
+        if chunk:
+            yield chunk
+    yield compressor.flush()
+
+def is_overridden(obj, base, name):
+    """check if the method ``name`` of ``obj`` is overridden, which means that it is a different
+    implementation than the one of the class ``base``.
+
+    :param obj: The instance to check, e.g. a module
+    :param base: The base class which defines the default implementation
+    :param name: The name of the method to check
+    """
+    if name in getattr(obj, "__dict__", {}):
+        return True # set directly on the instance
+    method = getattr(type(obj), name, None)
+    return getattr(method, "im_func", method) is not getattr(base, name).im_func
+
 def fix_types(params, type_map):
     """fixes parameters which might come in as string but need to be e.g. boolean
 
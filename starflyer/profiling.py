@@ -0,0 +1,171 @@
+"""
+on demand profiling of handlers with cProfile.
+
+If ``profiling`` is enabled in the configuration the application gets a
+:class:`Profiler` as ``app.profiler``. It does nothing until it is armed for
+an endpoint, e.g. in a shell or via the :class:`ProfilerHandler`::
+
+    app.profiler.arm("index", count = 10)       # profile the next 10 requests
+    app.profiler.arm("*", rate = 0.01)          # profile 1% of all requests
+    print app.profiler.report("index")
+
+The results are aggregated per endpoint and, if ``profiling_dir`` is configured,
+written to ``<profiling_dir>/<endpoint>.pstats`` which can be loaded with
+``pstats`` or tools like snakeviz.
+"""
+
+import os
+import random
+import pstats
+import cProfile
+import threading
+from StringIO import StringIO
+
+import werkzeug.exceptions
+from .handler import Handler
+
+__all__ = ['Profiler', 'ProfilerHandler']
+
+# endpoint name for arming the profiler for all endpoints
+ALL = "*"
+
+class Profiler(object):
+    """profiles handler calls for the endpoints it is armed for"""
+
+    def __init__(self, dump_dir = None):
+        """initialize the profiler
+
+        :param dump_dir: directory to write the aggregated statistics of each endpoint to
+        """
+        self.dump_dir = dump_dir
+        self.targets = {}   # endpoint -> [rate, remaining requests or None]
+        self.stats = {}     # endpoint -> pstats.Stats
+        self.armed = False
+        self._lock = threading.Lock()
+
+    def arm(self, endpoint = ALL, count = None, rate = 1.0):
+        """start profiling requests for an endpoint
+
+        :param endpoint: the endpoint to profile or ``"*"`` for all endpoints
+        :param count: the number of requests to profile, ``None`` means until disarmed
+        :param rate: the fraction of requests to profile
+        """
+        with self._lock:
+            self.targets[endpoint] = [rate, count]
+            self.armed = True
+
+    def disarm(self, endpoint = None):
+        """stop profiling an endpoint or everything if no endpoint is given"""
+        with self._lock:
+            if endpoint is None:
+                self.targets.clear()
+            else:
+                self.targets.pop(endpoint, None)
+            self.armed = bool(self.targets)
+
+    def should_profile(self, endpoint):
+        """return whether the request for ``endpoint`` should be profiled"""
+        with self._lock:
+            key = endpoint if endpoint in self.targets else ALL
+            target = self.targets.get(key)
+            if target is None:
+                return False
+            rate, remaining = target
+            if rate < 1.0 and random.random() >= rate:
+                return False
+            if remaining is not None:
+                if remaining <= 1:
+                    del self.targets[key]
+                    self.armed = bool(self.targets)
+                else:
+                    target[1] = remaining - 1
+            return True
+
+    def runcall(self, endpoint, func, *args, **kwargs):
+        """call ``func`` with the profiler enabled and record the result for ``endpoint``"""
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            self.add(endpoint, profile)
+
+    def add(self, endpoint, profile):
+        """add the results of a ``cProfile.Profile`` to the statistics of ``endpoint``"""
+        with self._lock:
+            stats = self.stats.get(endpoint)
+            if stats is None:
+                stats = self.stats[endpoint] = pstats.Stats(profile, stream = StringIO())
+            else:
+                stats.add(profile)
+            if self.dump_dir is not None:
+                stats.dump_stats(os.path.join(self.dump_dir, "%s.pstats" %endpoint))
+
+    def report(self, endpoint = None, sort = "cumulative", limit = 30):
+        """return the statistics as text
+
+        :param endpoint: the endpoint to report, ``None`` for all profiled endpoints
+        :param sort: the key to sort by, see ``pstats.Stats.sort_stats``
+        :param limit: the number of functions to list per endpoint
+        """
+        out = StringIO()
+        with self._lock:
+            endpoints = sorted(self.stats) if endpoint is None else [endpoint]
+            for ep in endpoints:
+                stats = self.stats.get(ep)
+                if stats is None:
+                    continue
+                out.write("==== %s\n" %ep)
+                stats.stream = out
+                stats.sort_stats(sort).print_stats(limit)
+        return out.getvalue()
+
+    def reset(self):
+        """remove all collected statistics"""
+        with self._lock:
+            self.stats = {}
+
+
+class ProfilerHandler(Handler):
+    """admin handler for the profiler. A ``GET`` request returns the report (the
+    parameters ``endpoint``, ``sort`` and ``limit`` are passed to :meth:`Profiler.report`),
+    a ``POST`` request with ``action`` set to ``arm``, ``disarm`` or ``reset`` controls it
+    (``arm`` takes ``endpoint``, ``count`` and ``rate``).
+
+    Only the ``sort`` keys in :attr:`sort_keys` are allowed.
+
+    Make sure to only add it to your routes with some access control, e.g. by
+    subclassing it and checking the user in :meth:`before`.
+    """
+
+    sort_keys = ("cumulative", "time", "calls", "name")
+
+    def get_profiler(self):
+        """return the profiler of the app or raise a 404 if profiling is disabled"""
+        profiler = self.app.profiler
+        if profiler is None:
+            raise werkzeug.exceptions.NotFound()
+        return profiler
+
+    def get(self):
+        profiler = self.get_profiler()
+        args = self.request.args
+        sort = args.get("sort", "cumulative")
+        if sort not in self.sort_keys:
+            raise werkzeug.exceptions.BadRequest("unknown sort key")
+        report = profiler.report(args.get("endpoint"), sort, args.get("limit", 30, type = int))
+        return self.app.response_class(report, mimetype = "text/plain")
+
+    def post(self):
+        profiler = self.get_profiler()
+        form = self.request.form
+        action = form.get("action")
+        if action == "arm":
+            profiler.arm(form.get("endpoint", ALL), form.get("count", None, type = int),
+                form.get("rate", 1.0, type = float))
+        elif action == "disarm":
+            profiler.disarm(form.get("endpoint"))
+        elif action == "reset":
+            profiler.reset()
+        else:
+            raise werkzeug.exceptions.BadRequest("unknown action")
+        return self.app.response_class("ok", mimetype = "text/plain")
@@ -0,0 +1,82 @@
+"""
+routing related helpers
+"""
+
+import threading
+from collections import OrderedDict
+
+class Dispatch(object):
+    """a precomputed dispatch record which is attached to a URL rule. It contains
+    everything needed to instantiate the handler for a matched rule so that no
+    lookups need to be done while processing a request.
+    """
+
+    __slots__ = ['handler', 'module']
+
+    def __init__(self, handler, module = None):
+        """initialize the dispatch record
+
+        :param handler: the handler class to be used for the rule
+        :param module: the :class:`~starflyer.Module` the rule belongs to or ``None`` for the app
+        """
+        self.handler = handler
+        self.module = module
+
+    def __repr__(self):
+        return "<Dispatch %s (module: %s)>" %(self.handler.__name__, self.module and self.module.name)
+
+
+class MatchCache(object):
+    """a bounded LRU cache for the results of url matching. It maps a key describing
+    the request (server name, subdomain, script name, method and path) to the matched
+    rule and view arguments. Only successful matches are stored.
+    """
+
+    def __init__(self, size):
+        """initialize the cache
+
+        :param size: the maximum number of entries to keep
+        """
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return the cached ``(rule, view_args)`` tuple for ``key`` or ``None``"""
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses = self.misses + 1
+                return None
+            self._data[key] = value # mark it as most recently used
+            self.hits = self.hits + 1
+            return value
+
+    def set(self, key, value):
+        """store a ``(rule, view_args)`` tuple and evict the least recently used entry
+        if the cache is full"""
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            if len(self._data) > self.size:
+                self._data.popitem(last = False)
+
+    def clear(self):
+        """remove all entries, e.g. because the url map changed"""
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """return a dictionary with the number of hits, misses and entries"""
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            entries = len(self._data),
+            size = self.size,
+        )
+
+    def __len__(self):
+        return len(self._data)
@@ -1,6 +1,7 @@
 import argparse
 import os
 from paste.deploy import loadapp
+from static import StaticManifest
 
 
 
@@ -23,4 +24,60 @@ class ScriptBase(object):
         """hook for extending the parser by adding new parameters"""
 
 
+class CompileTemplates(ScriptBase):
+    """precompile all templates of an application into the template bytecode cache
+    so that new worker processes do not need to compile them from source."""
 
+    description = "precompile all templates into the template bytecode cache"
+
+    def extend_parser(self):
+        """add the option for the cache directory"""
+        self.parser.add_argument('-d', dest="cache_dir", metavar='DIR', default=None,
+            help='the bytecode cache directory (defaults to template_bytecode_cache_dir of the app configuration)')
+
+    def __call__(self):
+        """compile the templates"""
+        config = self.app.config
+        if self.args.cache_dir is not None:
+            config.template_bytecode_cache_dir = self.args.cache_dir
+        if config.template_bytecode_cache_dir is None:
+            print "no bytecode cache directory configured, please set template_bytecode_cache_dir or use -d"
+            return 1
+        names, errors = self.app.compile_templates()
+        for name in sorted(errors):
+            print "could not compile %s: %s" %(name, errors[name])
+        print "compiled %s templates into %s" %(len(names) - len(errors), config.template_bytecode_cache_dir)
+        return 1 if errors else 0
+
+
+def compile_templates():
+    """entry point for the ``compile_templates`` script"""
+    return CompileTemplates()()
+
+
+class BuildStaticManifest(ScriptBase):
+    """hash all static files of an application and write the manifest for fingerprinted
+    static URLs so that it does not need to be computed on startup."""
+
+    description = "build the manifest for fingerprinted static URLs"
+
+    def extend_parser(self):
+        """add the option for the output file"""
+        self.parser.add_argument('-o', dest="output", metavar='FILE', default=None,
+            help='the file to write the manifest to (defaults to static_manifest_file of the app configuration)')
+
+    def __call__(self):
+        """build and write the manifest"""
+        filename = self.args.output or self.app.config.static_manifest_file
+        if filename is None:
+            print "no manifest file configured, please set static_manifest_file or use -o"
+            return 1
+        manifest = StaticManifest.from_app(self.app)
+        manifest.save(filename)
+        print "wrote %s static files to %s" %(len(manifest.entries), filename)
+        return 0
+
+
+def build_static_manifest():
+    """entry point for the ``build_static_manifest`` script"""
+    return BuildStaticManifest()()
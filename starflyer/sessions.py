@@ -7,8 +7,22 @@
     :license: BSD, see LICENSE for more details.
 """
 
+import os
+import time
+import hmac
+import hashlib
+import threading
+import sqlite3
+import zlib
+import base64
+import cPickle as pickle
+import logbook
+from collections import OrderedDict
 from datetime import datetime
 from werkzeug.contrib.securecookie import SecureCookie
+from werkzeug.datastructures import CallbackDict
+from werkzeug.security import safe_str_cmp
+from helpers import json
 
 class Cookie(SecureCookie):
     """our own cookie implementation which not only stores the payload but
@@ -45,6 +59,108 @@ class Cookie(SecureCookie):
             force=True)
         
 
+####
+#### serialization
+####
+
+class TaggedJSONSerializer(object):
+    """serializes session values as compact JSON. Types which JSON cannot represent
+    (tuples, sets, datetimes and byte strings which are not UTF-8) are stored as single
+    key dictionaries with a tag as key. Values whose JSON representation exceeds
+    ``compress_threshold`` bytes are compressed with zlib if that makes them smaller.
+
+    Serialized values start with ``!`` for plain and ``~`` for compressed JSON.
+    Anything else is treated as a pickle written by older versions so existing
+    cookies stay valid and get rewritten in the new format on the next save.
+    Values which cannot be stored as JSON at all (e.g. ``Decimal``, your own
+    objects or dictionaries with keys which are not strings) are still pickled
+    and a warning is logged.
+    Note that the cookie signature is checked before values are loaded.
+    """
+
+    tags = (' t', ' s', ' d', ' b', ' di')
+    datetime_format = "%Y-%m-%dT%H:%M:%S.%f"
+
+    def __init__(self, compress_threshold = 256):
+        """initialize the serializer
+
+        :param compress_threshold: the size in bytes above which values get compressed.
+            Use ``None`` to disable compression.
+        """
+        self.compress_threshold = compress_threshold
+
+    def tag(self, value):
+        """convert ``value`` into something JSON can store"""
+        if isinstance(value, dict):
+            for k in value:
+                if not isinstance(k, basestring):
+                    # JSON would silently convert the key to a string
+                    raise TypeError("dictionary key %r is not a string" %(k,))
+            if len(value) == 1:
+                k, v = value.items()[0]
+                if k in self.tags:
+                    # escape dictionaries which look like a tag
+                    return {' di' : {k + '__' : self.tag(v)}}
+            return dict((k, self.tag(v)) for k, v in value.iteritems())
+        elif isinstance(value, list):
+            return [self.tag(x) for x in value]
+        elif isinstance(value, tuple):
+            return {' t' : [self.tag(x) for x in value]}
+        elif isinstance(value, (set, frozenset)):
+            return {' s' : [self.tag(x) for x in value]}
+        elif isinstance(value, datetime):
+            if value.tzinfo is not None:
+                value = (value - value.utcoffset()).replace(tzinfo = None)
+            return {' d' : value.strftime(self.datetime_format)}
+        elif isinstance(value, str):
+            try:
+                return value.decode("utf-8")
+            except UnicodeDecodeError:
+                return {' b' : base64.b64encode(value)}
+        return value
+
+    def untag(self, obj):
+        """``object_hook`` for the JSON decoder which reverts :meth:`tag`"""
+        if len(obj) != 1:
+            return obj
+        k, v = obj.items()[0]
+        if k == ' t':
+            return tuple(v)
+        elif k == ' s':
+            return set(v)
+        elif k == ' d':
+            return datetime.strptime(v, self.datetime_format)
+        elif k == ' b':
+            return base64.b64decode(v)
+        elif k == ' di':
+            k, v = v.items()[0]
+            return {k[:-2] : v}
+        return obj
+
+    def dumps(self, value):
+        """serialize a value to a byte string"""
+        try:
+            data = json.dumps(self.tag(value), separators=(',', ':'))
+        except (TypeError, ValueError), e:
+            logbook.warning("session value cannot be stored as JSON and is pickled instead: %s" %e)
+            return pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if self.compress_threshold is not None and len(data) > self.compress_threshold:
+            compressed = zlib.compress(data)
+            if len(compressed) < len(data):
+                return "~" + compressed
+        return "!" + data
+
+    def loads(self, data):
+        """load a value serialized by :meth:`dumps` (or pickled by older versions)"""
+        if data[:1] == "!":
+            return json.loads(data[1:], object_hook=self.untag)
+        elif data[:1] == "~":
+            return json.loads(zlib.decompress(data[1:]), object_hook=self.untag)
+        return pickle.loads(data)
+
+session_json_serializer = TaggedJSONSerializer()
+
+
 class SessionMixin(object):
     """Expands a basic dictionary with an accessors that are expected
     by Flask extensions and users for the session.
@@ -68,14 +184,23 @@ class SessionMixin(object):
     #: for some backends this will always be `True`, but some backends will
     #: default this to false and detect changes in the dictionary for as
     #: long as changes do not happen on mutable structures in the session.
+    #: If you change such a nested structure call :meth:`mark_modified`.
     #: The default mixin implementation just hardcodes `True` in.
     modified = True
 
+    def mark_modified(self):
+        """mark the session as modified so that it gets saved at the end of the
+        request. Use this after changing mutable values stored in the session, e.g.
+        ``session['items'].append(item)``, as these changes cannot be detected."""
+        self.modified = True
+
 class SecureCookieSession(SecureCookie, SessionMixin):
     """Expands the session with support for switching between permanent
     and non-permanent sessions.
     """
 
+    serialization_method = session_json_serializer
+
 
 class NullSession(SecureCookieSession):
     """Class used to generate nicer error messages if sessions are not
@@ -190,6 +315,16 @@ class SessionInterface(object):
         if session.permanent:
             return datetime.utcnow() + app.config.permanent_session_lifetime
 
+    def should_save_session(self, app, session):
+        """return whether the session needs to be saved at the end of the request.
+        This is the case if it has been modified or if it is permanent and the
+        configuration option ``session_refresh_each_request`` is set so that
+        the expiration date of the cookie gets refreshed.
+        """
+        if session.modified:
+            return True
+        return session.permanent and app.config.get('session_refresh_each_request', False)
+
     def open_session(self, app, request):
         """This method has to be implemented and must either return `None`
         in case the loading failed because of a configuration error or an
@@ -213,10 +348,25 @@ class SecureCookieSessionInterface(SessionInterface):
     """
     session_class = SecureCookieSession
 
+    # the serializer for the session values, needs ``dumps()`` and ``loads()``
+    serializer = session_json_serializer
+
+    def get_session_class(self):
+        """return the session class which uses :attr:`serializer`"""
+        cls = self.session_class
+        if cls.serialization_method is self.serializer:
+            return cls
+        rv = self.__dict__.get('_serializing_session_class')
+        if rv is None or rv.__bases__[0] is not cls or rv.serialization_method is not self.serializer:
+            rv = self._serializing_session_class = type(cls.__name__, (cls,), {
+                'serialization_method' : self.serializer,
+            })
+        return rv
+
     def open_session(self, app, request):
         key = app.config.get('secret_key', None)
         if key is not None or app.config.testing:
-            session = self.session_class.load_cookie(request,
+            session = self.get_session_class().load_cookie(request,
                                                   app.config.session_cookie_name,
                                                   secret_key=key)
             return session
@@ -233,8 +383,213 @@ class SecureCookieSessionInterface(SessionInterface):
         if session.modified and not session:
             response.delete_cookie(app.config.session_cookie_name, path=path,
                                    domain=domain)
-        else:
-            if hasattr(response, "set_cookie"):
-                session.save_cookie(response, app.config.session_cookie_name, path=path,
-                                expires=expires, httponly=httponly,
-                                secure=secure, domain=domain)
+        elif hasattr(response, "set_cookie") and self.should_save_session(app, session):
+            session.save_cookie(response, app.config.session_cookie_name, path=path,
+                            expires=expires, httponly=httponly,
+                            secure=secure, domain=domain, force=True)
+
+
+####
+#### server side sessions
+####
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """a session whose data is stored on the server in a :class:`SessionStore`. The
+    cookie only contains the signed session id. Modifications of the dictionary are
+    tracked so that unchanged sessions are not written back to the store.
+    """
+
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class SessionStore(object):
+    """base class for the backends storing the data of server side sessions"""
+
+    def load(self, sid):
+        """return the session data stored for the session id ``sid`` as dictionary
+        or ``None`` if it does not exist or is expired"""
+        raise NotImplementedError()
+
+    def save(self, sid, data, expires):
+        """store the session data for the session id ``sid``
+
+        :param sid: the session id
+        :param data: the session data as dictionary
+        :param expires: the timestamp after which the session expires
+        """
+        raise NotImplementedError()
+
+    def delete(self, sid):
+        """remove the session with the id ``sid``"""
+        raise NotImplementedError()
+
+
+class MemorySessionStore(SessionStore):
+    """stores sessions in memory of the process. The number of sessions is bounded and the
+    least recently used sessions are removed first. Note that sessions are not shared
+    between processes with this store.
+    """
+
+    def __init__(self, max_entries = 10000):
+        """initialize the store
+
+        :param max_entries: the maximum number of sessions to keep
+        """
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._data.pop(sid, None)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.time():
+                return None
+            self._data[sid] = entry # mark it as most recently used
+        return pickle.loads(data)
+
+    def save(self, sid, data, expires):
+        # store it pickled so that later modifications of the session do not change it
+        entry = (expires, pickle.dumps(data, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._data.pop(sid, None)
+            self._data[sid] = entry
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last = False)
+
+    def delete(self, sid):
+        with self._lock:
+            self._data.pop(sid, None)
+
+
+class SQLiteSessionStore(SessionStore):
+    """stores sessions in an SQLite database file which can be shared between the
+    processes on one machine. Expired sessions can be removed with :meth:`cleanup`.
+    """
+
+    def __init__(self, path, table = "sessions"):
+        """initialize the store
+
+        :param path: the path of the database file
+        :param table: the name of the table to use
+        """
+        self.path = path
+        self.table = table
+        self._local = threading.local()
+        conn = self.get_connection()
+        conn.execute("CREATE TABLE IF NOT EXISTS %s (sid TEXT PRIMARY KEY, data BLOB, expires REAL)" %table)
+        conn.commit()
+
+    def get_connection(self):
+        """return the database connection for the current thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = sqlite3.connect(self.path, timeout=10)
+        return conn
+
+    def load(self, sid):
+        row = self.get_connection().execute(
+            "SELECT data FROM %s WHERE sid = ? AND expires > ?" %self.table,
+            (sid, time.time())).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(str(row[0]))
+
+    def save(self, sid, data, expires):
+        conn = self.get_connection()
+        conn.execute("INSERT OR REPLACE INTO %s (sid, data, expires) VALUES (?, ?, ?)" %self.table,
+            (sid, sqlite3.Binary(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)), expires))
+        conn.commit()
+
+    def delete(self, sid):
+        conn = self.get_connection()
+        conn.execute("DELETE FROM %s WHERE sid = ?" %self.table, (sid,))
+        conn.commit()
+
+    def cleanup(self):
+        """remove all expired sessions"""
+        conn = self.get_connection()
+        conn.execute("DELETE FROM %s WHERE expires <= ?" %self.table, (time.time(),))
+        conn.commit()
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """a session interface which stores the session data on the server in a
+    :class:`SessionStore` and only puts the signed session id into the cookie.
+    Sessions are only written to the store if they have been modified and the
+    cookie is only sent for new sessions and to refresh permanent ones.
+
+    To use it set it on your application class::
+
+        class MyApp(Application):
+            session_interface = ServerSideSessionInterface(SQLiteSessionStore("/tmp/sessions.db"))
+    """
+
+    session_class = ServerSideSession
+
+    def __init__(self, store = None):
+        """initialize the session interface
+
+        :param store: the :class:`SessionStore` to use. Defaults to a :class:`MemorySessionStore`.
+        """
+        if store is None:
+            store = MemorySessionStore()
+        self.store = store
+
+    def generate_sid(self):
+        """return a new random session id"""
+        return os.urandom(20).encode("hex")
+
+    def get_signature(self, app, sid):
+        """return the signature of a session id"""
+        key = app.config.get('secret_key', None) or ""
+        return hmac.new(str(key), sid, hashlib.sha1).hexdigest()
+
+    def open_session(self, app, request):
+        key = app.config.get('secret_key', None)
+        if key is None and not app.config.testing:
+            print "*** CANNOT OPEN SESSION BECAUSE SECRET KEY IS MISSING IN THE CONFIGURATION"
+            return None
+        value = request.cookies.get(app.config.session_cookie_name)
+        if value and "." in value:
+            sid, signature = str(value).rsplit(".", 1)
+            if safe_str_cmp(signature, self.get_signature(app, sid)):
+                data = self.store.load(sid)
+                if data is not None:
+                    return self.session_class(data, sid=sid)
+        return self.session_class(sid=self.generate_sid(), new=True)
+
+    def save_session(self, app, session, response):
+        """save a session to the store and set the cookie if necessary"""
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if not session:
+            # remove a session which was emptied
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                if hasattr(response, "delete_cookie"):
+                    response.delete_cookie(app.config.session_cookie_name, path=path, domain=domain)
+            return
+
+        if not self.should_save_session(app, session):
+            return
+        lifetime = app.config.permanent_session_lifetime
+        expires = time.time() + lifetime.days * 86400 + lifetime.seconds
+        self.store.save(session.sid, dict(session), expires)
+
+        # the cookie only needs to be sent for new sessions and to refresh the expiration date
+        if (session.new or session.permanent) and hasattr(response, "set_cookie"):
+            value = "%s.%s" %(session.sid, self.get_signature(app, session.sid))
+            response.set_cookie(app.config.session_cookie_name, value,
+                                expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app),
+                                secure=self.get_cookie_secure(app),
+                                domain=domain, path=path)
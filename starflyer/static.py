@@ -1,22 +1,288 @@
 from .handler import Handler
 import os
+import stat
 import mimetypes
 import time
+import datetime
+import hashlib
+import json
+import gzip
+import shutil
+import tempfile
+import threading
 import pkg_resources
+from collections import OrderedDict
 
-from werkzeug.datastructures import Headers
+from werkzeug.datastructures import Headers, ContentRange
+from werkzeug.http import is_resource_modified, unquote_etag, parse_date
+from werkzeug.urls import url_quote
 import werkzeug.exceptions
 
+from .helpers import is_compressible
+
 try:
     from werkzeug.wsgi import wrap_file
 except ImportError:
     from werkzeug.utils import wrap_file
 
+class StaticManifest(object):
+    """a manifest mapping the static files of the app and the modules to fingerprinted
+    filenames which contain a hash of the file content, e.g. ``css/app.css`` to
+    ``css/app.0123456789.css``. These URLs change whenever the content changes and can
+    thus be cached forever by browsers.
+
+    Entries are stored per static endpoint, i.e. ``static`` for the app and
+    ``<module>.static`` for modules.
+    """
+
+    # number of hex digits of the MD5 hash to use in filenames
+    hash_length = 10
+
+    def __init__(self, entries = None):
+        """initialize the manifest
+
+        :param entries: a dictionary mapping endpoints to dictionaries which map filenames
+            to fingerprinted filenames
+        """
+        self.entries = {}
+        self.reverse = {}
+        for endpoint, files in (entries or {}).items():
+            for filename, hashed in files.items():
+                self.add(endpoint, filename, hashed)
+
+    def add(self, endpoint, filename, hashed):
+        """add a fingerprinted filename for a file of a static endpoint"""
+        self.entries[(endpoint, filename)] = hashed
+        self.reverse[(endpoint, hashed)] = filename
+
+    def fingerprint(self, filename, digest):
+        """return the fingerprinted version of filename using the given hex digest"""
+        base, ext = os.path.splitext(filename)
+        return "%s.%s%s" %(base, digest[:self.hash_length], ext)
+
+    def add_folder(self, endpoint, path):
+        """hash all files in the directory ``path`` and add them for the given endpoint"""
+        for dirpath, dirnames, filenames in os.walk(path):
+            for fn in filenames:
+                fullpath = os.path.join(dirpath, fn)
+                md5 = hashlib.md5()
+                with open(fullpath, "rb") as fp:
+                    for chunk in iter(lambda: fp.read(65536), ""):
+                        md5.update(chunk)
+                filename = os.path.relpath(fullpath, path).replace(os.sep, "/")
+                self.add(endpoint, filename, self.fingerprint(filename, md5.hexdigest()))
+
+    @classmethod
+    def from_app(cls, app):
+        """build the manifest by hashing all files in the static folders of the app and
+        it's modules"""
+        manifest = cls()
+        if app.config.static_folder is not None:
+            path = pkg_resources.resource_filename(app.import_name, app.config.static_folder)
+            if os.path.isdir(path):
+                manifest.add_folder("static", path)
+        for module in app.modules:
+            if module.config.static_folder is None:
+                continue
+            path = pkg_resources.resource_filename(module.import_name, module.config.static_folder)
+            if os.path.isdir(path):
+                manifest.add_folder(module.name.strip().lower()+".static", path)
+        return manifest
+
+    @classmethod
+    def load(cls, filename):
+        """load a manifest from a JSON file as written by :meth:`save`"""
+        with open(filename, "rb") as fp:
+            return cls(json.load(fp))
+
+    def save(self, filename):
+        """save the manifest to a JSON file"""
+        data = {}
+        for (endpoint, fn), hashed in self.entries.items():
+            data.setdefault(endpoint, {})[fn] = hashed
+        with open(filename, "wb") as fp:
+            json.dump(data, fp, indent=1, sort_keys=True)
+
+    def url_values(self, endpoint, values):
+        """return the URL values for building the URL of a static endpoint with the
+        filename replaced by the fingerprinted one if it's part of the manifest"""
+        filename = values.get("filename")
+        if filename is None:
+            return values
+        hashed = self.entries.get((endpoint, filename))
+        if hashed is None:
+            return values
+        values = dict(values)
+        values['filename'] = hashed
+        return values
+
+    def resolve(self, endpoint, filename):
+        """return the original filename for a fingerprinted one or ``None`` if it's unknown"""
+        return self.reverse.get((endpoint, filename))
+
+
+class CachedFile(object):
+    """a static file stored in the :class:`StaticFileCache`"""
+
+    __slots__ = ['path', 'mtime', 'orig_size', 'data', 'mimetype', 'etag', 'last_modified',
+                 'headers', 'checked']
+
+    def __init__(self, path, st, data, mimetype, etag, last_modified, headers):
+        """initialize the cache entry
+
+        :param path: the filesystem path of the original file
+        :param st: the stat result of the original file used for checking for changes
+        :param data: the content to send (which might be a compressed version)
+        :param mimetype: the mimetype of the file
+        :param etag: the etag of the content
+        :param last_modified: the modification date of the file
+        :param headers: a list of additional headers like ``Content-Encoding``
+        """
+        self.path = path
+        self.mtime = st.st_mtime
+        self.orig_size = st.st_size
+        self.data = data
+        self.mimetype = mimetype
+        self.etag = etag
+        self.last_modified = last_modified
+        self.headers = headers
+        self.checked = time.time()
+
+
+class StaticFileCache(object):
+    """an in-memory LRU cache for small static files which is bounded by the total size
+    of the cached files. Entries are checked for changes on the filesystem after
+    ``check_interval`` seconds.
+    """
+
+    def __init__(self, max_size, check_interval = 2):
+        """initialize the cache
+
+        :param max_size: the maximum number of bytes to store
+        :param check_interval: seconds after which a cached file is checked for changes again
+        """
+        self.max_size = max_size
+        self.check_interval = check_interval
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """return the :class:`CachedFile` for ``key`` or ``None`` if it's not cached
+        or the file has changed"""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self._entries[key] = entry # mark it as most recently used
+
+        now = time.time()
+        if now - entry.checked > self.check_interval:
+            try:
+                st = os.stat(entry.path)
+                changed = st.st_mtime != entry.mtime or st.st_size != entry.orig_size
+            except OSError:
+                changed = True
+            if changed:
+                self.remove(key)
+                with self._lock:
+                    self.misses = self.misses + 1
+                return None
+            entry.checked = now
+
+        with self._lock:
+            self.hits = self.hits + 1
+        return entry
+
+    def set(self, key, entry):
+        """store a :class:`CachedFile` and evict the least recently used entries if the
+        cache gets too big"""
+        size = len(entry.data)
+        if size > self.max_size:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size = self.size - len(old.data)
+            self._entries[key] = entry
+            self.size = self.size + size
+            while self.size > self.max_size:
+                k, old = self._entries.popitem(last = False)
+                self.size = self.size - len(old.data)
+                self.evictions = self.evictions + 1
+
+    def remove(self, key):
+        """remove an entry from the cache"""
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size = self.size - len(old.data)
+
+    def clear(self):
+        """remove all entries"""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        """return a dictionary with the cache statistics for monitoring"""
+        return dict(
+            hits = self.hits,
+            misses = self.misses,
+            evictions = self.evictions,
+            entries = len(self._entries),
+            size = self.size,
+            max_size = self.max_size,
+        )
+
+    def __len__(self):
+        return len(self._entries)
+
+
 class StaticFileHandler(Handler):
-    """handles static files"""
+    """handles static files
+
+    Files inside a package on the filesystem are served with an open file and a
+    ``Content-Length`` header so that the WSGI server can use ``wsgi.file_wrapper``
+    and ``sendfile()``. Alternatively the sending can be offloaded to a front proxy
+    by setting ``static_offload`` to ``x-sendfile`` or ``x-accel-redirect``.
+
+    Files on the filesystem also get an ``ETag`` and ``Last-Modified`` header,
+    conditional requests are answered with ``304 Not Modified`` and single byte
+    ranges are supported.
+
+    If fingerprinting is enabled via ``static_fingerprint`` fingerprinted filenames
+    from the app's :class:`StaticManifest` are mapped back to the original files and
+    served with caching headers for ``static_fingerprint_max_age`` seconds.
+
+    Compressible files can be served in a compressed version if the client accepts it.
+    With ``static_precompressed`` enabled ``.br`` and ``.gz`` files next to the requested
+    file are used and with ``static_compress_cache_dir`` set gzipped versions are created
+    on first request and stored in that directory.
+
+    Small files can be kept in memory by setting ``static_memory_cache_size`` to the
+    number of bytes the app's :class:`StaticFileCache` may use.
+    """
 
     use_hooks = False
 
+    # mapping from file path to ``(mtime, size, etag)``. ETags are computed from the file
+    # content and are only recomputed if modification time or size of the file changed.
+    etags = {}
+
+    # size of the chunks to read when sending a byte range
+    buffer_size = 8192
+
+    # precompressed siblings to look for as tuples of ``(encoding, file extension)``
+    precompressed_variants = [
+        ('br', '.br'),
+        ('gzip', '.gz'),
+    ]
+
     def __init__(self, app, request, module = None):
         self.app = app
         self.request = request
@@ -34,30 +300,288 @@ class StaticFileHandler(Handler):
 
         return self.make_response(self.get(**m))
 
+    def get_static_source(self):
+        """return the import name of the package and the static folder inside it to use"""
+        if self.module is not None:
+            return self.module.import_name, self.module.config.static_folder
+        return self.app.import_name, self.app.config.static_folder
+
+    def get_path(self, import_name, folder, filename):
+        """return the filesystem path of the requested file or ``None`` if the package is not
+        stored on the filesystem (e.g. in a zipped egg). Raises ``NotFound`` if the filename
+        tries to leave the static folder.
+
+        :param import_name: the name of the package containing the static folder
+        :param folder: the static folder inside the package
+        :param filename: the filename relative to the static folder
+        """
+        filename = os.path.normpath(filename)
+        if os.path.isabs(filename) or filename.startswith(os.pardir):
+            raise werkzeug.exceptions.NotFound()
+        if not isinstance(pkg_resources.get_provider(import_name), pkg_resources.DefaultProvider):
+            return None
+        return os.path.join(pkg_resources.resource_filename(import_name, folder), filename)
+
+    def get_etag(self, path, size, mtime):
+        """return the strong ETag for a file which is the MD5 hash of it's content. It is cached
+        until the modification time or size of the file change.
+
+        :param path: the filesystem path of the file
+        :param size: the size of the file
+        :param mtime: the modification time of the file
+        """
+        cached = self.etags.get(path)
+        if cached is not None and cached[0] == mtime and cached[1] == size:
+            return cached[2]
+        md5 = hashlib.md5()
+        with open(path, "rb") as fp:
+            for chunk in iter(lambda: fp.read(65536), ""):
+                md5.update(chunk)
+        etag = md5.hexdigest()
+        self.etags[path] = (mtime, size, etag)
+        return etag
+
+    def get_compressed_variant(self, path, st, compress_cache = True):
+        """return a tuple ``(path, stat result, encoding)`` of a compressed version of the file
+        the client accepts or ``None`` if there is none.
+
+        :param path: the filesystem path of the original file
+        :param st: the stat result of the original file
+        :param compress_cache: ``False`` to only use precompressed files next to the original
+        """
+        accepted = self.request.accept_encodings
+        if self.config.static_precompressed:
+            for encoding, ext in self.precompressed_variants:
+                if not accepted.quality(encoding):
+                    continue
+                try:
+                    variant_st = os.stat(path+ext)
+                except OSError:
+                    continue
+                if variant_st.st_mtime >= st.st_mtime: # ignore outdated versions
+                    return path+ext, variant_st, encoding
+
+        cache_dir = self.config.static_compress_cache_dir
+        if cache_dir is not None and compress_cache and accepted.quality("gzip") \
+            and st.st_size >= self.config.static_compress_min_size:
+            key = path.encode("utf-8") if isinstance(path, unicode) else path
+            variant = os.path.join(cache_dir, "%s-%d-%d.gz" %(
+                hashlib.md5(key).hexdigest(), int(st.st_mtime), st.st_size))
+            if not os.path.exists(variant):
+                self.write_gzip(path, variant)
+            return variant, os.stat(variant), "gzip"
+        return None
+
+    def write_gzip(self, path, variant):
+        """write a gzipped version of the file at ``path`` to the file ``variant``. A temporary
+        file is used so that concurrent requests never see a partially written file."""
+        cache_dir = os.path.dirname(variant)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        fd, tmpname = tempfile.mkstemp(dir=cache_dir)
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                gz = gzip.GzipFile(filename="", mode="wb", fileobj=tmp, mtime=0)
+                with open(path, "rb") as fp:
+                    shutil.copyfileobj(fp, gz)
+                gz.close()
+            os.rename(tmpname, variant)
+        except:
+            os.unlink(tmpname)
+            raise
+
+    def get_range(self, etag, last_modified, size):
+        """return the ``(start, stop)`` tuple of the byte range requested or ``None`` if the
+        whole file should be sent. Raises ``RequestedRangeNotSatisfiable`` if the range is
+        invalid for the file.
+        """
+        rng = self.request.range
+        if rng is None or rng.units != "bytes" or len(rng.ranges) != 1:
+            return None
+
+        # only send the range if the file did not change according to If-Range
+        if_range = self.request.headers.get("If-Range")
+        if if_range:
+            if unquote_etag(if_range)[0] != etag and parse_date(if_range) != last_modified:
+                return None
+
+        result = rng.range_for_length(size)
+        if result is None:
+            raise werkzeug.exceptions.RequestedRangeNotSatisfiable()
+        return result
+
+    def iter_range(self, fp, start, stop):
+        """iterate over the file contents between ``start`` and ``stop`` and close the file
+        in the end"""
+        try:
+            fp.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                chunk = fp.read(min(self.buffer_size, remaining))
+                if not chunk:
+                    break
+                remaining = remaining - len(chunk)
+                yield chunk
+        finally:
+            fp.close()
+
+    def get_accepted_encodings(self):
+        """return a tuple of the compressed encodings accepted by the client which are
+        relevant for the configured compression"""
+        if not self.config.static_precompressed and self.config.static_compress_cache_dir is None:
+            return ()
+        accepted = self.request.accept_encodings
+        return tuple([encoding for encoding, ext in self.precompressed_variants
+                      if accepted.quality(encoding)])
+
     def get(self, filename=None):
         """return a static file"""
-        if self.module is not None:
-            try:
-                fp = pkg_resources.resource_stream(self.module.import_name, os.path.join(self.module.config.static_folder, filename))
-            except IOError:
-                raise werkzeug.exceptions.NotFound()
-            config = self.module.config
+        # check if we have a fingerprinted filename
+        immutable = False
+        manifest = self.app.static_manifest
+        if manifest is not None and self.request.url_rule is not None:
+            original = manifest.resolve(self.request.url_rule.endpoint, filename)
+            if original is not None:
+                filename = original
+                immutable = True
+
+        import_name, folder = self.get_static_source()
+        offload = self.config.static_offload
+
+        # try the in-memory cache first
+        cache = self.app.static_cache
+        if cache is not None and offload is None:
+            key = (import_name, folder, filename, self.get_accepted_encodings())
+            entry = cache.get(key)
+            if entry is not None:
+                return self.send_cached_file(entry, immutable)
         else:
-            try:
-                fp = pkg_resources.resource_stream(self.app.import_name, os.path.join(self.app.config.static_folder, filename))
-            except IOError:
-                raise werkzeug.exceptions.NotFound()
-            config = self.app.config
-        
+            cache = None
+
+        path = self.get_path(import_name, folder, filename)
+
         mimetype = mimetypes.guess_type(filename)[0]
         if mimetype is None:
             mimetype = 'application/octet-stream'
 
         headers = Headers()
-        data = wrap_file(self.request.environ, fp)
+        status = 200
+
+        if path is None:
+            # the package is not on the filesystem so we need to stream it via pkg_resources
+            try:
+                fp = pkg_resources.resource_stream(import_name, os.path.join(folder, filename))
+            except IOError:
+                raise werkzeug.exceptions.NotFound()
+            rv = self.app.response_class(wrap_file(self.request.environ, fp), mimetype=mimetype,
+                                         headers=headers, direct_passthrough=True)
+            return self.add_cache_headers(rv, immutable)
+
+        try:
+            orig_st = st = os.stat(path)
+        except OSError:
+            raise werkzeug.exceptions.NotFound()
+        if not stat.S_ISREG(st.st_mode):
+            raise werkzeug.exceptions.NotFound()
+        orig_path = path
+        size = st.st_size
+        last_modified = datetime.datetime.utcfromtimestamp(int(st.st_mtime))
+        etag = self.get_etag(path, size, st.st_mtime)
+
+        # use a compressed version if possible
+        if (self.config.static_precompressed or self.config.static_compress_cache_dir is not None) \
+            and is_compressible(mimetype):
+            headers['Vary'] = "Accept-Encoding"
+            # the internal location of x-accel-redirect only aliases the static folder
+            # so files from the compress cache cannot be offloaded that way
+            variant = self.get_compressed_variant(path, st, offload != "x-accel-redirect")
+            if variant is not None:
+                path, st, encoding = variant
+                size = st.st_size
+                etag = "%s-%s" %(etag, encoding) # each representation needs it's own etag
+                headers['Content-Encoding'] = encoding
 
-        rv = self.app.response_class(data, mimetype=mimetype, headers=headers,
-                                        direct_passthrough=True)
+        # small files are stored in the in-memory cache
+        if cache is not None and size <= self.config.static_memory_cache_max_file_size:
+            with open(path, "rb") as fp:
+                data = fp.read()
+            entry = CachedFile(orig_path, orig_st, data, mimetype, etag, last_modified, list(headers.items()))
+            cache.set(key, entry)
+            return self.send_cached_file(entry, immutable)
+
+        if not is_resource_modified(self.request.environ, etag=etag, last_modified=last_modified):
+            rv = self.app.response_class(None, status=304, mimetype=mimetype, headers=headers)
+        elif offload == "x-sendfile":
+            headers['X-Sendfile'] = path
+            headers['Content-Length'] = size
+            rv = self.app.response_class(None, mimetype=mimetype, headers=headers,
+                                         direct_passthrough=True)
+        elif offload == "x-accel-redirect":
+            # the internal location aliases the static folder so we pass the path relative to it
+            relpath = os.path.relpath(path, pkg_resources.resource_filename(import_name, folder))
+            headers['X-Accel-Redirect'] = self.config.static_accel_redirect_prefix.rstrip("/") + \
+                "/" + url_quote(relpath.replace(os.sep, "/"))
+            headers['Content-Length'] = size
+            rv = self.app.response_class(None, mimetype=mimetype, headers=headers,
+                                         direct_passthrough=True)
+        else:
+            rng = self.get_range(etag, last_modified, size)
+            fp = open(path, "rb")
+            headers['Accept-Ranges'] = "bytes"
+            if rng is None:
+                # a real file allows the server to use sendfile() via wsgi.file_wrapper
+                headers['Content-Length'] = size
+                data = wrap_file(self.request.environ, fp)
+            else:
+                start, stop = rng
+                status = 206
+                headers['Content-Range'] = ContentRange("bytes", start, stop, size).to_header()
+                headers['Content-Length'] = stop - start
+                data = self.iter_range(fp, start, stop)
+            rv = self.app.response_class(data, status=status, mimetype=mimetype, headers=headers,
+                                         direct_passthrough=True)
+
+        rv.set_etag(etag)
+        rv.last_modified = last_modified
+        return self.add_cache_headers(rv, immutable)
+
+    def send_cached_file(self, entry, immutable = False):
+        """create the response for a file from the in-memory cache
+
+        :param entry: the :class:`CachedFile` to send
+        :param immutable: ``True`` if a fingerprinted URL was requested
+        """
+        headers = Headers(entry.headers)
+        status = 200
+        data = entry.data
+        if not is_resource_modified(self.request.environ, etag=entry.etag, last_modified=entry.last_modified):
+            status = 304
+            data = None
+        else:
+            headers['Accept-Ranges'] = "bytes"
+            size = len(data)
+            rng = self.get_range(entry.etag, entry.last_modified, size)
+            if rng is not None:
+                start, stop = rng
+                status = 206
+                headers['Content-Range'] = ContentRange("bytes", start, stop, size).to_header()
+                data = data[start:stop]
+        rv = self.app.response_class(data, status=status, mimetype=entry.mimetype, headers=headers)
+        rv.set_etag(entry.etag)
+        rv.last_modified = entry.last_modified
+        return self.add_cache_headers(rv, immutable)
+
+    def add_cache_headers(self, rv, immutable = False):
+        """add the caching headers to the response
+
+        :param rv: the response
+        :param immutable: ``True`` if a fingerprinted URL was requested which never changes
+        """
+        if immutable:
+            cache_timeout = self.config.static_fingerprint_max_age
+            rv.headers['Cache-Control'] = "public, max-age=%d, immutable" %cache_timeout
+            rv.expires = int(time.time() + cache_timeout)
+            return rv
 
         rv.cache_control.public = True
         cache_timeout = self.config.static_cache_timeout
@@ -65,5 +589,5 @@ class StaticFileHandler(Handler):
             rv.cache_control.max_age = cache_timeout
             rv.expires = int(time.time() + cache_timeout)
         return rv
-            
+
 
@@ -14,16 +14,36 @@
 from jinja2 import BaseLoader, Environment as BaseEnvironment, \
      TemplateNotFound
 import os
+import time
 
 class DispatchingJinjaLoader(BaseLoader):
     """A loader that looks for templates in the application and all
     the modules.
+
+    In order to not ask all the loaders on each lookup an index mapping each
+    template name to the loader responsible for it is built on first use. Templates
+    not in the index (e.g. from loaders which cannot list their templates) are
+    still looked up the usual way. In debug mode the index is rebuilt every
+    ``reload_interval`` seconds so that new and removed templates are picked up.
     """
 
+    #: seconds after which the index is rebuilt in debug mode
+    reload_interval = 1
+
     def __init__(self, app):
         self.app = app
+        self.index = None
+        self.index_time = 0
 
     def get_source(self, environment, template):
+        entry = self.get_index().get(template)
+        if entry is not None:
+            loader, local_name = entry
+            try:
+                return loader.get_source(environment, local_name)
+            except TemplateNotFound:
+                pass # maybe removed in the meantime, try all loaders then
+
         for loader, local_name in self._iter_loaders(template):
             try:
                 return loader.get_source(environment, local_name)
@@ -32,6 +52,27 @@ class DispatchingJinjaLoader(BaseLoader):
 
         raise TemplateNotFound(template)
 
+    def get_index(self):
+        """return the template index and build it if it's missing or outdated"""
+        if self.index is None or \
+            (self.app.config.debug and time.time() - self.index_time > self.reload_interval):
+            self.build_index()
+        return self.index
+
+    def build_index(self):
+        """build the index mapping all template names to a tuple of the loader to use
+        and the template name local to that loader.
+
+        The same precedence as in :meth:`_iter_loaders` applies which means that
+        application templates override module templates.
+        """
+        index = {}
+        for name, loader, local_name in self._iter_templates():
+            index[name] = (loader, local_name)
+        self.index = index
+        self.index_time = time.time()
+        return index
+
     def _iter_loaders(self, template):
         """iterate over all the loaders, both from application and from modules.
 
@@ -54,19 +95,32 @@ class DispatchingJinjaLoader(BaseLoader):
             if module.jinja_loader is not None:
                 yield module.jinja_loader, template
 
-    def list_templates(self):
-        result = set()
-        loader = self.app.jinja_loader
-        if loader is not None:
-            result.update(loader.list_templates())
-
+    def _iter_templates(self):
+        """iterate over all the templates the loaders can list as tuples of the
+        name, the loader and the name local to that loader. Module templates come
+        first so that application templates with the same name override them."""
         for module in self.app.modules:
-            loader = module.jinja_loader
-            if loader is not None:
-                for template in loader.list_templates():
-                    result.add(template)
-
-        return list(result)
-
+            prefix = "_m/%s/" %module.name
+            for name in _list_loader_templates(module.jinja_loader):
+                yield prefix+name, module.jinja_loader, name
 
+        loader = self.app.jinja_loader
+        for name in _list_loader_templates(loader):
+            yield name, loader, name
 
+    def list_templates(self):
+        # module templates can only be found with the module prefix
+        return list(set(name for name, loader, local_name in self._iter_templates()))
+
+
+def _list_loader_templates(loader):
+    """return the templates of ``loader``. Loaders which cannot list their templates
+    and loaders whose template folder does not exist yield no templates."""
+    if loader is None:
+        return []
+    try:
+        return loader.list_templates()
+    except TypeError:
+        return [] # this loader cannot list it's templates
+    except (OSError, IOError):
+        return [] # the template folder does not exist
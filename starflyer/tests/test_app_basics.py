@@ -1,3 +1,4 @@
+import werkzeug
 
 def test_app_basics(client):
 
@@ -40,3 +41,54 @@ def test_strict_slashes(client):
 
     resp = client.get("/branch/")
     assert resp.status_code == 200
+
+def test_dispatch_records(app):
+    rules = dict((rule.endpoint, rule) for rule in app.url_map.iter_rules())
+    dispatch = rules['index'].dispatch
+    assert dispatch.handler is app.handlers['index']
+    assert dispatch.module is None
+
+def test_dispatch_for_late_rules(client):
+    from conftest import TestHandler2
+    client.application.add_url_rule("/late", "late", TestHandler2)
+    resp = client.get('/late')
+    assert resp.data == "test2"
+
+def test_dispatch_for_reregistered_endpoint(client):
+    from conftest import TestHandler2
+    # the index endpoint gets a second rule and a new handler which all it's rules use
+    client.application.add_url_rule("/index2", "index", TestHandler2)
+    assert client.get('/index2').data == "test2"
+    assert client.get('/').data == "test2"
+
+def test_url_match_cache():
+    from conftest import TestApplication, TestHandler2
+    app = TestApplication(__name__, url_match_cache_size = 2)
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    assert client.get('/post/1').data == "1"
+    assert client.get('/post/1').data == "1"
+    assert client.get('/post/2').data == "2"
+    assert app.match_cache.stats()['hits'] == 1
+    assert app.match_cache.stats()['misses'] == 2
+
+    # the least recently used entry is evicted
+    client.get('/huhu')
+    assert len(app.match_cache) == 2
+    client.get('/post/1')
+    assert app.match_cache.stats()['misses'] == 4
+
+    # adding rules invalidates the cache
+    app.add_url_rule("/late", "late", TestHandler2)
+    assert len(app.match_cache) == 0
+    assert client.get('/late').data == "test2"
+
+def test_shift_path_info():
+    from conftest import TestApplication
+    app = TestApplication(__name__, shift_path_info = 1)
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    assert client.get('/prefix/huhu').data == "test2"
+
+    # changed settings are used after recompiling the WSGI app
+    app.config.shift_path_info = 0
+    app.wsgi_app = app.compile_wsgi_app()
+    assert client.get('/huhu').data == "test2"
@@ -123,3 +123,48 @@ def test_dotted_update_no_dict():
         'foo' : 'bar',
         'e.foo' : 'bar'
     })
+
+def test_fast_update():
+    base = AttributeMapper({
+        'a' : AttributeMapper({
+            'b' : 9,
+            'c' : 10,
+        }),
+        'd' : {'e' : 1},
+    })
+    am = AttributeMapper()
+    dict.update(am, base)
+    am.fast_update({
+        'foo'   : 'bar',
+        'a.b'   : 13,
+        'd'     : {'f' : 2},
+    })
+
+    assert am.foo == "bar"
+    assert am.a.b == 13
+    assert am.a.c == 10
+    assert am.d == {'e' : 1, 'f' : 2}
+
+    # the original dictionaries are not changed
+    assert base.a.b == 9
+    assert base.d == {'e' : 1}
+
+def test_fast_update_deep_dotted_key():
+    base = AttributeMapper({
+        'a' : AttributeMapper({
+            'b' : AttributeMapper({
+                'c' : 1,
+            }),
+        }),
+    })
+    am = AttributeMapper()
+    dict.update(am, base)
+    am.fast_update({'a.b.c' : 2})
+    assert am.a.b.c == 2
+    assert base.a.b.c == 1
+
+    am = AttributeMapper()
+    dict.update(am, base)
+    am.fast_update({'a' : {'b' : {'c' : 3}}})
+    assert am.a.b.c == 3
+    assert base.a.b.c == 1
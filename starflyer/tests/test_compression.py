@@ -0,0 +1,79 @@
+from starflyer import Application, Handler, URL
+import werkzeug
+import gzip
+from StringIO import StringIO
+
+BODY = "<p>compress me</p>" * 100
+
+class BigHandler(Handler):
+
+    def get(self):
+        return BODY
+
+class SmallHandler(Handler):
+
+    def get(self):
+        return "small"
+
+class StreamHandler(Handler):
+
+    def get(self):
+        def generate():
+            for i in range(100):
+                yield "<p>chunk %s</p>" %i
+        return self.app.response_class(generate())
+
+class ImageHandler(Handler):
+
+    def get(self):
+        return self.app.response_class(BODY, mimetype="image/png")
+
+class CompressionApplication(Application):
+    """app with response compression enabled"""
+
+    routes = [
+        URL("/big",     "big",      BigHandler),
+        URL("/small",   "small",    SmallHandler),
+        URL("/stream",  "stream",   StreamHandler),
+        URL("/image",   "image",    ImageHandler),
+    ]
+
+    defaults = {
+        'testing'               : True,
+        'compress_responses'    : True,
+    }
+
+def pytest_funcarg__client(request):
+    app = CompressionApplication(__name__)
+    return werkzeug.Client(app, werkzeug.BaseResponse)
+
+def gunzip(data):
+    return gzip.GzipFile(fileobj = StringIO(data)).read()
+
+def test_compression(client):
+    resp = client.get("/big", headers = {'Accept-Encoding' : 'gzip'})
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert resp.headers['Vary'] == "Accept-Encoding"
+    assert int(resp.headers['Content-Length']) == len(resp.data)
+    assert gunzip(resp.data) == BODY
+
+def test_no_compression_without_accept_encoding(client):
+    resp = client.get("/big")
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Vary'] == "Accept-Encoding"
+    assert resp.data == BODY
+
+def test_no_compression_for_small_responses(client):
+    resp = client.get("/small", headers = {'Accept-Encoding' : 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.data == "small"
+
+def test_no_compression_for_images(client):
+    resp = client.get("/image", headers = {'Accept-Encoding' : 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+
+def test_streamed_compression(client):
+    resp = client.get("/stream", headers = {'Accept-Encoding' : 'gzip'})
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert 'Content-Length' not in resp.headers
+    assert gunzip(resp.data) == "".join(["<p>chunk %s</p>" %i for i in range(100)])
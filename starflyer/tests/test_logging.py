@@ -0,0 +1,58 @@
+from starflyer import Application, Handler, URL
+import logbook
+import werkzeug
+
+
+class LogHandler(Handler):
+
+    def get(self):
+        logbook.Logger("test").info("logging from handler")
+        return "ok"
+
+class LogApplication(Application):
+    """an app which logs into a test handler"""
+
+    routes = [
+        URL("/log",     "log",      LogHandler),
+    ]
+
+    defaults = {
+        'testing'   : True,
+    }
+
+    setup_count = 0
+
+    def setup_logger(self):
+        self.setup_count = self.setup_count + 1
+        self.log_handler = logbook.TestHandler(bubble=False)
+        return self.log_handler
+
+def pytest_funcarg__app(request):
+    return LogApplication(__name__)
+
+def pytest_funcarg__client(request):
+    app = request.getfuncargvalue('app')
+    return werkzeug.Client(app, werkzeug.BaseResponse)
+
+def test_log_record_injection(client):
+    client.get("/log?foo=bar")
+    record = client.application.log_handler.records[0]
+    assert record.message == "logging from handler"
+    assert record.extra['url'] == "http://localhost/log?foo=bar"
+    assert record.extra['method'] == "GET"
+
+def test_log_setup_is_cached(client):
+    client.get("/log")
+    client.get("/log")
+    app = client.application
+    assert app.setup_count == 1
+    assert len(app.log_handler.records) == 2
+    assert app.log_handler.records[1].extra['url'] == "http://localhost/log"
+
+def test_log_setup_per_request(client):
+    app = client.application
+    app.config.cache_logger = False
+    client.get("/log")
+    client.get("/log")
+    assert app.setup_count == 2
+    assert len(app.log_handler.records) == 1
@@ -0,0 +1,100 @@
+import gc
+import threading
+import pytest
+import logbook
+from starflyer.contrib.loghandlers import BufferedMongoHandler
+
+class FakeCollection(object):
+    """collects the bulk inserts instead of writing them to a database. If ``blocking``
+    is set, inserts wait until ``release`` is set."""
+
+    def __init__(self, blocking = False):
+        self.inserts = []
+        self.inserted = threading.Event()
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not blocking:
+            self.release.set()
+
+    def insert(self, docs):
+        self.started.set()
+        self.release.wait(5)
+        self.inserts.append(docs)
+        self.inserted.set()
+
+    @property
+    def docs(self):
+        return [doc for docs in self.inserts for doc in docs]
+
+
+def log_messages(handler, count):
+    log = logbook.Logger("test")
+    with handler.applicationbound():
+        for i in range(count):
+            log.warn("message %s" %i)
+
+def test_records_are_written_in_batches():
+    collection = FakeCollection()
+    handler = BufferedMongoHandler(collection, batch_size = 10, flush_interval = 60)
+    log_messages(handler, 25)
+    handler.flush()
+    assert [len(docs) for docs in collection.inserts] == [10, 10, 5]
+    assert collection.docs[0]['message'] == "message 0"
+    handler.close()
+
+def test_records_are_written_after_interval():
+    collection = FakeCollection()
+    handler = BufferedMongoHandler(collection, batch_size = 100, flush_interval = 0.05)
+    log_messages(handler, 3)
+    assert collection.inserted.wait(5)
+    assert len(collection.docs) == 3
+    handler.close()
+
+def test_close_writes_waiting_records():
+    collection = FakeCollection()
+    handler = BufferedMongoHandler(collection, batch_size = 100, flush_interval = 60)
+    log_messages(handler, 3)
+    handler.close()
+    assert len(collection.docs) == 3
+
+def fill_queue_while_writing(overflow):
+    """log one record which blocks the writer thread and then 4 more into a queue of size 2"""
+    collection = FakeCollection(blocking = True)
+    handler = BufferedMongoHandler(collection, batch_size = 1, max_queue_size = 2, overflow = overflow)
+    log_messages(handler, 1)
+    assert collection.started.wait(5)
+    log_messages(handler, 4)
+    collection.release.set()
+    handler.close()
+    return handler, collection
+
+def test_overflow_drop_new():
+    handler, collection = fill_queue_while_writing("drop_new")
+    assert handler.dropped == 2
+    assert [doc['message'] for doc in collection.docs] == ["message 0", "message 0", "message 1"]
+
+def test_overflow_drop_oldest():
+    handler, collection = fill_queue_while_writing("drop_oldest")
+    assert handler.dropped == 2
+    assert [doc['message'] for doc in collection.docs] == ["message 0", "message 2", "message 3"]
+
+def test_close_does_not_block_without_writer():
+    collection = FakeCollection(blocking = True)
+    handler = BufferedMongoHandler(collection, batch_size = 1, max_queue_size = 1)
+    handler.close_timeout = 0.01
+    log_messages(handler, 1)
+    assert collection.started.wait(5)
+    log_messages(handler, 1) # the queue is full now and the writer is stuck
+    handler.close()
+    collection.release.set()
+
+def test_unused_handler_is_collected():
+    handler = BufferedMongoHandler(FakeCollection(), flush_interval = 0.01)
+    thread = handler._thread
+    del handler
+    gc.collect()
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_unknown_overflow_policy():
+    pytest.raises(ValueError, BufferedMongoHandler, FakeCollection(), overflow = "foo")
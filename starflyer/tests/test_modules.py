@@ -39,3 +39,44 @@ def test_module_config_external(module_test_client2):
     assert resp.data.strip() == "bar"
 
 
+
+def test_module_dispatch(module_test_client1):
+    app = module_test_client1.application
+    rules = dict((rule.endpoint, rule) for rule in app.url_map.iter_rules())
+    assert rules['test.index'].dispatch.module is app.module_map['test']
+
+def test_module_templates_are_listed_with_prefix(module_test_client1):
+    names = module_test_client1.application.jinja_env.list_templates()
+    assert "_m/test/test.html" in names
+    assert "test.html" not in names
+
+def test_template_index(module_test_client1):
+    app = module_test_client1.application
+    module_test_client1.get('/test/')
+    index = app.jinja_env.loader.index
+    assert index["_m/test/test.html"][0] is app.module_map['test'].jinja_loader
+    # app templates override module templates
+    assert index["_m/test/test2.html"][0] is not app.module_map['test'].jinja_loader
+
+def test_template_index_reload_in_debug(module_test_client1):
+    app = module_test_client1.application
+    module_test_client1.get('/test/')
+    index = app.jinja_env.loader.index
+    module_test_client1.get('/test/')
+    assert app.jinja_env.loader.index is index
+    app.config.debug = True
+    app.jinja_env.loader.index_time = 0
+    module_test_client1.get('/test/')
+    assert app.jinja_env.loader.index is not index
+
+def test_module_without_templates_folder():
+    from conftest import TestApplication
+    from starflyer import Module
+    class App(TestApplication):
+        modules = [Module("starflyer.contrib", name = "notemplates")()]
+    app = App(__name__)
+    response = app.run_request(path="/render")
+    assert response.data == "<h1>rendered</h1>"
+    names, errors = app.compile_templates()
+    assert "index.html" in names
+    assert not [name for name in names if name.startswith("_m/notemplates/")]
@@ -15,3 +15,18 @@ def test_before_and_after(client):
     resp = client.get('/')
     assert resp.headers['X-After'] == 'foobar'
 
+
+def test_hook_chains(module_app1):
+    # only the overridden before_handler of the module is part of the chains
+    assert len(module_app1.before_handler_hooks) == 1
+    assert module_app1.before_handler_hooks[0].im_self is module_app1.modules[0]
+    assert module_app1.after_handler_hooks == []
+    assert module_app1.render_context_hooks == []
+
+def test_rebuild_hook_chains(client_mod_app1):
+    app = client_mod_app1.application
+    app.before_handler = lambda handler: app.response_class("stopped by app")
+    app.rebuild_hook_chains()
+    assert len(app.before_handler_hooks) == 2
+    resp = client_mod_app1.get('/')
+    assert resp.data == "stopped by app"
@@ -0,0 +1,63 @@
+import os
+from conftest import TestApplication
+from starflyer.profiling import ProfilerHandler
+
+def pytest_funcarg__profiling_app(request):
+    app = TestApplication(__name__, profiling = True)
+    app.add_url_rule("/_profiler", "profiler", ProfilerHandler)
+    return app
+
+def test_profiler_is_disabled_by_default(app):
+    assert app.profiler is None
+    response = app.run_request(path="/huhu")
+    assert response.status_code == 200
+
+def test_disarmed_profiler_does_nothing(profiling_app):
+    profiling_app.run_request(path="/huhu")
+    assert not profiling_app.profiler.armed
+    assert profiling_app.profiler.stats == {}
+
+def test_profile_endpoint_with_count(profiling_app):
+    profiler = profiling_app.profiler
+    profiler.arm("huhu", count = 2)
+    profiling_app.run_request(path="/")
+    for i in range(3):
+        response = profiling_app.run_request(path="/huhu")
+        assert response.status_code == 200
+    assert not profiler.armed
+    assert profiler.stats.keys() == ["huhu"]
+    assert profiler.stats['huhu'].total_calls > 0
+    assert "==== huhu" in profiler.report()
+
+def test_profile_rate(profiling_app):
+    profiler = profiling_app.profiler
+    profiler.arm(rate = 0.0)
+    profiling_app.run_request(path="/huhu")
+    assert profiler.stats == {}
+    profiler.arm(rate = 1.0)
+    profiling_app.run_request(path="/huhu")
+    assert "huhu" in profiler.stats
+    profiler.disarm()
+    assert not profiler.armed
+
+def test_dump_dir(tmpdir):
+    app = TestApplication(__name__, profiling = True, profiling_dir = str(tmpdir))
+    app.profiler.arm("huhu")
+    app.run_request(path="/huhu")
+    assert os.path.exists(str(tmpdir.join("huhu.pstats")))
+
+def test_profiler_handler(profiling_app):
+    response = profiling_app.run_request(path="/_profiler", method="POST",
+        data = {'action' : 'arm', 'endpoint' : 'huhu', 'count' : '1'})
+    assert response.data == "ok"
+    profiling_app.run_request(path="/huhu")
+    response = profiling_app.run_request(path="/_profiler?endpoint=huhu&limit=5")
+    assert "==== huhu" in response.data
+    profiling_app.run_request(path="/_profiler", method="POST", data = {'action' : 'reset'})
+    assert profiling_app.profiler.stats == {}
+
+def test_profiler_handler_sort(profiling_app):
+    response = profiling_app.run_request(path="/_profiler?sort=time")
+    assert response.status_code == 200
+    response = profiling_app.run_request(path="/_profiler?sort=unknown")
+    assert response.code == 400
@@ -87,3 +87,172 @@ def test_multiple_handlers_and_flashing(client, app):
     assert resp.data == "[u'hello']" 
 
 
+
+def test_session_is_loaded_lazily(app):
+    app.config.secret_key = "foobar"
+    response = app.run_request(path="/huhu")
+    assert not app.last_handler.session_loaded
+    assert "Set-Cookie" not in response.headers
+    response = app.run_request(path="/session")
+    assert app.last_handler.session_loaded
+    assert "Set-Cookie" in response.headers
+
+def test_unmodified_session_is_not_saved(app):
+    app.config.secret_key = "foobar"
+    response = app.run_request(path="/flash")
+    assert app.last_handler.session_loaded
+    assert "Set-Cookie" not in response.headers
+
+def test_server_side_session(app):
+    from starflyer.sessions import ServerSideSessionInterface, MemorySessionStore
+    import werkzeug
+    store = MemorySessionStore()
+    app.session_interface = ServerSideSessionInterface(store)
+    app.config.secret_key = "foobar"
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    resp = client.get("/session", base_url="http://example.org/")
+    cookie = resp.headers['Set-Cookie']
+    sid = cookie.split("=", 1)[1].split(".")[0]
+    assert store.load(sid) == {'foo' : 'bar'}
+    resp = client.get("/check_session", base_url="http://example.org/")
+    assert resp.data == "bar"
+    assert 'Set-Cookie' not in resp.headers
+
+def test_server_side_session_bad_signature(app):
+    from starflyer.sessions import ServerSideSessionInterface, MemorySessionStore
+    import werkzeug
+    store = MemorySessionStore()
+    store.save("abc", {'foo' : 'bar'}, 2**31)
+    app.session_interface = ServerSideSessionInterface(store)
+    app.config.secret_key = "foobar"
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    client.set_cookie("example.org", "s", "abc.wrong")
+    resp = client.get("/session?s=new", base_url="http://example.org/")
+    assert not resp.headers['Set-Cookie'].startswith("s=abc.")
+    assert store.load("abc") == {'foo' : 'bar'}
+
+def test_sqlite_session_store(tmpdir):
+    from starflyer.sessions import SQLiteSessionStore
+    store = SQLiteSessionStore(str(tmpdir.join("sessions.db")))
+    store.save("abc", {'foo' : 'bar'}, 2**31)
+    store.save("old", {'foo' : 'bar'}, 1)
+    assert store.load("abc") == {'foo' : 'bar'}
+    assert store.load("old") is None
+    store.cleanup()
+    store.delete("abc")
+    assert store.load("abc") is None
+
+def test_memory_session_store_is_bounded():
+    from starflyer.sessions import MemorySessionStore
+    store = MemorySessionStore(max_entries = 2)
+    for sid in ("a", "b", "c"):
+        store.save(sid, {'sid' : sid}, 2**31)
+    assert store.load("a") is None
+    assert store.load("c") == {'sid' : 'c'}
+
+def test_permanent_session_is_refreshed(client):
+    client.application.config.secret_key = "foobar"
+    base_url = "http://example.org/"
+    resp = client.get("/session?permanent=1", base_url=base_url)
+
+    # unmodified sessions are not sent again by default
+    resp = client.get("/check_session", base_url=base_url)
+    assert resp.data == "bar"
+    assert 'set-cookie' not in resp.headers
+
+    client.application.config.session_refresh_each_request = True
+    resp = client.get("/check_session", base_url=base_url)
+    assert 'set-cookie' in resp.headers
+
+def test_mark_modified(app):
+    from starflyer.sessions import SecureCookieSession
+    session = SecureCookieSession({'items' : []}, "foobar", new=False)
+    session['items'].append(1)
+    assert not session.modified
+    assert not app.session_interface.should_save_session(app, session)
+    session.mark_modified()
+    assert app.session_interface.should_save_session(app, session)
+
+def test_tagged_json_serializer():
+    from starflyer.sessions import TaggedJSONSerializer
+    s = TaggedJSONSerializer()
+    value = {
+        'a' : (1, 2, [3, (4,)]),
+        'd' : datetime.datetime(2012, 3, 4, 5, 6, 7, 890),
+        'b' : "\xff\x00",
+        't' : {' t' : [1, 2]},
+        'u' : u"\xfcber",
+        's' : set([1, (2, 3)]),
+    }
+    data = s.dumps(value)
+    assert data.startswith("!")
+    assert s.loads(data) == value
+
+def test_tagged_json_serializer_compression():
+    from starflyer.sessions import TaggedJSONSerializer
+    s = TaggedJSONSerializer(compress_threshold = 100)
+    value = ["message %s" %i for i in range(50)]
+    data = s.dumps(value)
+    assert data.startswith("~")
+    assert len(data) < len(s.dumps(value[:5])) * 10
+    assert s.loads(data) == value
+
+def test_old_pickled_session_cookie_is_accepted(client):
+    from werkzeug.contrib.securecookie import SecureCookie
+    client.application.config.secret_key = "foobar"
+    old = SecureCookie({'foo' : 'old'}, "foobar")
+    client.set_cookie("example.org", "s", old.serialize())
+    resp = client.get("/check_session", base_url="http://example.org/")
+    assert resp.data == "old"
+
+    # a modification writes the new format
+    resp = client.get("/session", base_url="http://example.org/")
+    value = resp.headers['Set-Cookie'].split(";")[0].split("?foo=", 1)[1]
+    assert value.strip('"').decode("base64") == '!"bar"'
+
+def test_custom_session_serializer(app):
+    from starflyer.sessions import SecureCookieSessionInterface, TaggedJSONSerializer
+    interface = SecureCookieSessionInterface()
+    interface.serializer = TaggedJSONSerializer(compress_threshold = None)
+    cls = interface.get_session_class()
+    assert cls.serialization_method is interface.serializer
+    assert interface.get_session_class() is cls
+
+def test_tagged_json_serializer_falls_back_to_pickle():
+    from decimal import Decimal
+    from starflyer.sessions import TaggedJSONSerializer
+    s = TaggedJSONSerializer()
+    data = s.dumps([Decimal("1.5")])
+    assert data[:1] not in ("!", "~")
+    assert s.loads(data) == [Decimal("1.5")]
+
+def test_tagged_json_serializer_non_string_keys():
+    from starflyer.sessions import TaggedJSONSerializer
+    s = TaggedJSONSerializer()
+    value = {1 : 'a', (1, 2) : 'b'}
+    data = s.dumps(value)
+    assert data[:1] not in ("!", "~") # JSON would turn the keys into strings
+    assert s.loads(data) == value
+
+def test_old_pickled_session_cookie_with_set_is_migrated(client):
+    from werkzeug.contrib.securecookie import SecureCookie
+    app = client.application
+    app.config.secret_key = "foobar"
+    base_url = "http://example.org/"
+    old = SecureCookie({'foo' : 'old', 'tags' : set(["a", "b"])}, "foobar")
+    client.set_cookie("example.org", "s", old.serialize())
+
+    # modifying the session rewrites the whole cookie in the new format
+    resp = client.get("/session?s=new", base_url=base_url)
+    assert resp.status_code == 200
+    value = resp.headers['Set-Cookie'].split(";")[0].split("=", 1)[1].strip('"')
+    for item in value.split("?", 1)[1].split("&"):
+        assert item.split("=", 1)[1].decode("base64")[:1] == "!"
+
+    # and can be read again
+    import werkzeug
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    client.set_cookie("example.org", "s", value)
+    resp = client.get("/check_session", base_url=base_url)
+    assert resp.data == "new"
+    assert app.last_handler.session['tags'] == set(["a", "b"])
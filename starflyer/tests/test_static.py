@@ -0,0 +1,228 @@
+from starflyer import Application
+import werkzeug
+import pkg_resources
+import os
+import sys
+
+
+class StaticApplication(Application):
+    """app for testing static file serving"""
+
+    defaults = {
+        'testing'               : True,
+        'static_folder'         : 'static_folder/',
+    }
+
+def pytest_funcarg__app(request):
+    return StaticApplication(__name__)
+
+def pytest_funcarg__client(request):
+    app = request.getfuncargvalue('app')
+    return werkzeug.Client(app, werkzeug.BaseResponse)
+
+def test_static_file(client):
+    resp = client.get("/static/test.txt")
+    assert resp.status_code == 200
+    assert resp.data == "TEST\n"
+    assert resp.headers['Content-Length'] == "5"
+    assert resp.headers['Content-Type'].startswith("text/plain")
+
+def test_static_file_not_found(client):
+    resp = client.get("/static/missing.txt")
+    assert resp.status_code == 404
+
+def test_static_file_outside_folder(client):
+    resp = client.get("/static/..%2ftest_static.py")
+    assert resp.status_code == 404
+
+def test_x_sendfile(client, app):
+    app.config.static_offload = "x-sendfile"
+    resp = client.get("/static/test.txt")
+    path = pkg_resources.resource_filename(__name__, "static_folder/test.txt")
+    assert os.path.normpath(resp.headers['X-Sendfile']) == os.path.normpath(path)
+    assert resp.data == ""
+
+def test_x_accel_redirect(client, app):
+    app.config.static_offload = "x-accel-redirect"
+    app.config.static_accel_redirect_prefix = "/_internal"
+    resp = client.get("/static/test.txt")
+    assert resp.headers['X-Accel-Redirect'] == "/_internal/test.txt"
+    assert resp.data == ""
+
+    # the path is relative to the static folder and quoted
+    resp = client.get("/static/my%20file.css")
+    assert resp.headers['X-Accel-Redirect'] == "/_internal/my%20file.css"
+
+def test_etag_and_last_modified(client):
+    resp = client.get("/static/test.txt")
+    assert resp.headers['ETag'] == '"2debfdcf79f03e4a65a667d21ef9de14"' # md5 of the file
+    assert 'Last-Modified' in resp.headers
+
+def test_if_none_match(client):
+    resp = client.get("/static/test.txt")
+    etag = resp.headers['ETag']
+    resp = client.get("/static/test.txt", headers = {'If-None-Match' : etag})
+    assert resp.status_code == 304
+    assert resp.data == ""
+    resp = client.get("/static/test.txt", headers = {'If-None-Match' : '"other"'})
+    assert resp.status_code == 200
+
+def test_if_modified_since(client):
+    resp = client.get("/static/test.txt")
+    last_modified = resp.headers['Last-Modified']
+    resp = client.get("/static/test.txt", headers = {'If-Modified-Since' : last_modified})
+    assert resp.status_code == 304
+
+def test_range(client):
+    resp = client.get("/static/test.txt", headers = {'Range' : 'bytes=1-2'})
+    assert resp.status_code == 206
+    assert resp.data == "ES"
+    assert resp.headers['Content-Range'] == "bytes 1-2/5"
+    assert resp.headers['Content-Length'] == "2"
+
+def test_range_with_if_range(client):
+    resp = client.get("/static/test.txt", headers = {'Range' : 'bytes=1-2', 'If-Range' : '"other"'})
+    assert resp.status_code == 200
+    assert resp.data == "TEST\n"
+
+def test_range_not_satisfiable(client):
+    resp = client.get("/static/test.txt", headers = {'Range' : 'bytes=10-20'})
+    assert resp.status_code == 416
+
+def test_fingerprinted_urls():
+    app = StaticApplication(__name__, static_fingerprint = True)
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    url = app.url_for("static", filename = "test.txt")
+    assert url == "/static/test.2debfdcf79.txt"
+    assert app.url_for("static", filename = "unknown.txt") == "/static/unknown.txt"
+
+    resp = client.get(url)
+    assert resp.status_code == 200
+    assert resp.data == "TEST\n"
+    assert resp.headers['Cache-Control'] == "public, max-age=31536000, immutable"
+
+    # the original URL still works with the normal caching headers
+    resp = client.get("/static/test.txt")
+    assert resp.status_code == 200
+    assert "immutable" not in resp.headers['Cache-Control']
+
+def test_static_manifest_file(tmpdir):
+    filename = str(tmpdir.join("manifest.json"))
+    app = StaticApplication(__name__, static_fingerprint = True)
+    app.static_manifest.add("static", "other.txt", "other.123.txt")
+    app.static_manifest.save(filename)
+
+    app = StaticApplication(__name__, static_fingerprint = True, static_manifest_file = filename)
+    assert app.url_for("static", filename = "other.txt") == "/static/other.123.txt"
+
+def make_precompressed_package(tmpdir, monkeypatch):
+    """create a package with a gzipped file in its static folder in a temporary
+    directory so that no files are written to the source tree"""
+    pkg = tmpdir.mkdir("precompressed_pkg")
+    pkg.join("__init__.py").write("")
+    pkg.mkdir("static_folder").join("test.txt").write("TEST\n")
+    pkg.join("static_folder", "test.txt.gz").write("gzipped")
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.delitem(sys.modules, "precompressed_pkg", raising = False)
+    return "precompressed_pkg"
+
+def test_precompressed(tmpdir, monkeypatch):
+    app = StaticApplication(make_precompressed_package(tmpdir, monkeypatch), static_precompressed = True)
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip, deflate'})
+    assert resp.data == "gzipped"
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert resp.headers['Vary'] == "Accept-Encoding"
+    assert resp.headers['ETag'].endswith('-gzip"')
+
+    # clients not accepting gzip get the original file
+    resp = client.get("/static/test.txt")
+    assert resp.data == "TEST\n"
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Vary'] == "Accept-Encoding"
+
+def test_precompressed_offload(tmpdir, monkeypatch):
+    import_name = make_precompressed_package(tmpdir, monkeypatch)
+    app = StaticApplication(import_name, static_precompressed = True, static_offload = "x-sendfile")
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip'})
+    path = pkg_resources.resource_filename(import_name, "static_folder/test.txt.gz")
+    assert os.path.normpath(resp.headers['X-Sendfile']) == os.path.normpath(path)
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert resp.headers['Content-Length'] == "7"
+    assert resp.headers['ETag'].endswith('-gzip"')
+
+    app.config.static_offload = "x-accel-redirect"
+    app.config.static_accel_redirect_prefix = "/_internal"
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip'})
+    assert resp.headers['X-Accel-Redirect'] == "/_internal/test.txt.gz"
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert resp.headers['Content-Length'] == "7"
+
+    # files from the compress cache are not offloaded via x-accel-redirect
+    app.config.static_precompressed = False
+    app.config.static_compress_cache_dir = str(tmpdir.join("gz"))
+    app.config.static_compress_min_size = 0
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip'})
+    assert resp.headers['X-Accel-Redirect'] == "/_internal/test.txt"
+    assert 'Content-Encoding' not in resp.headers
+    assert resp.headers['Content-Length'] == "5"
+    assert not resp.headers['ETag'].endswith('-gzip"')
+
+def test_compress_cache_dir(client, app, tmpdir):
+    import gzip
+    from StringIO import StringIO
+    app.config.static_compress_cache_dir = str(tmpdir.join("gz"))
+    app.config.static_compress_min_size = 0
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip'})
+    assert resp.headers['Content-Encoding'] == "gzip"
+    assert gzip.GzipFile(fileobj = StringIO(resp.data)).read() == "TEST\n"
+    assert len(tmpdir.join("gz").listdir()) == 1
+
+    # files below the minimum size are not compressed
+    app.config.static_compress_min_size = 100
+    resp = client.get("/static/test.txt", headers = {'Accept-Encoding' : 'gzip'})
+    assert 'Content-Encoding' not in resp.headers
+
+def test_memory_cache():
+    app = StaticApplication(__name__, static_memory_cache_size = 1024)
+    client = werkzeug.Client(app, werkzeug.BaseResponse)
+    resp = client.get("/static/test.txt")
+    assert resp.data == "TEST\n"
+    etag = resp.headers['ETag']
+    resp = client.get("/static/test.txt")
+    assert resp.data == "TEST\n"
+    assert resp.headers['ETag'] == etag
+    assert app.static_cache.stats()['hits'] == 1
+    assert app.static_cache.stats()['misses'] == 1
+    assert app.static_cache.size == 5
+
+    resp = client.get("/static/test.txt", headers = {'If-None-Match' : etag})
+    assert resp.status_code == 304
+    resp = client.get("/static/test.txt", headers = {'Range' : 'bytes=1-2'})
+    assert resp.status_code == 206
+    assert resp.data == "ES"
+
+def test_memory_cache_eviction():
+    from starflyer.static import StaticFileCache, CachedFile
+    st = os.stat(__file__)
+    cache = StaticFileCache(10)
+    cache.set("a", CachedFile(__file__, st, "12345", "text/plain", "a", None, []))
+    cache.set("b", CachedFile(__file__, st, "12345", "text/plain", "b", None, []))
+    assert cache.get("a") is not None
+    cache.set("c", CachedFile(__file__, st, "12345", "text/plain", "c", None, []))
+    assert cache.get("b") is None # least recently used
+    assert cache.get("a") is not None
+    assert cache.stats()['evictions'] == 1
+    assert cache.size == 10
+
+def test_memory_cache_invalidation():
+    from starflyer.static import StaticFileCache, CachedFile
+    st = os.stat(__file__)
+    cache = StaticFileCache(10, check_interval = 0)
+    entry = CachedFile(__file__, st, "12345", "text/plain", "a", None, [])
+    entry.mtime = entry.mtime - 10
+    entry.checked = 0
+    cache.set("a", entry)
+    assert cache.get("a") is None
+    assert len(cache) == 0
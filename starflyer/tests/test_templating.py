@@ -16,3 +16,76 @@ def test_render_context_override(client):
     assert resp.data == "<h1>stuff from call</h1>" 
 
 
+
+def test_base_render_context_is_computed_once(app):
+    calls = []
+    def get_render_context(handler):
+        calls.append(handler)
+        return {'content' : 'from app'}
+    app.get_render_context = get_render_context
+    app.rebuild_hook_chains()
+    app.run_request(path="/render")
+    handler = app.last_handler
+    assert handler.render("index.html") == "<h1>from app</h1>"
+    assert handler.render("index.html", content="from call") == "<h1>from call</h1>"
+    assert len(calls) == 1
+
+def test_dotted_render_override_does_not_leak(app):
+    from starflyer import AttributeMapper
+    def get_render_context(handler):
+        return {'nested' : AttributeMapper({'inner' : AttributeMapper({'value' : 'base'})})}
+    app.get_render_context = get_render_context
+    app.rebuild_hook_chains()
+    app.run_request(path="/render")
+    handler = app.last_handler
+    assert handler.render("nested.html", **{'nested.inner.value' : 'override'}) == "<h1>override</h1>"
+    assert handler.render("nested.html") == "<h1>base</h1>"
+
+def test_shared_template_globals(app):
+    app.config.shared_template_globals = True
+    app.run_request(path="/render")
+    handler = app.last_handler
+    assert handler.render("globals.html") == "%s /huhu" %len(app.module_map)
+    tmpl = app.jinja_env.get_template("globals.html")
+    assert tmpl.globals is app.jinja_env.globals
+    assert "url_for" not in tmpl.globals
+
+def test_compile_templates(tmpdir):
+    from conftest import TestApplication
+    cache_dir = str(tmpdir.join("bytecode"))
+    app = TestApplication(__name__, template_bytecode_cache_dir = cache_dir)
+    names, errors = app.compile_templates()
+    assert "index.html" in names
+    assert errors == {}
+    assert len(tmpdir.join("bytecode").listdir()) == len(names)
+
+def test_render_stream(app):
+    from starflyer import Handler
+    class StreamHandler(Handler):
+        template = "stream.html"
+        def get(self):
+            return self.render_stream(items = range(20))
+    app.add_url_rule("/stream", "stream", StreamHandler)
+    response = app.run_request(path="/stream")
+    assert not response.is_sequence
+    chunks = list(response.iter_encoded())
+    assert len(chunks) > 1
+    assert "".join(chunks).strip() == "".join(["<li>%s</li>" %i for i in range(20)])
+
+    # jinja only supports buffering of at least 2 parts
+    app.config.template_stream_buffer_size = 1
+    response = app.run_request(path="/stream")
+    assert "".join(response.iter_encoded()).strip() == "".join(["<li>%s</li>" %i for i in range(20)])
+
+def test_stream_generator(app):
+    from starflyer import Handler
+    class GeneratorHandler(Handler):
+        def get(self):
+            def generate():
+                for i in range(3):
+                    yield "line %s\n" %i
+            return generate(), 201
+    app.add_url_rule("/generate", "generate", GeneratorHandler)
+    response = app.run_request(path="/generate")
+    assert response.status_code == 201
+    assert response.get_data() == "line 0\nline 1\nline 2\n"
@@ -0,0 +1,55 @@
+from conftest import TestApplication
+from starflyer.timing import RequestTimer, Reservoir
+
+def pytest_funcarg__timing_app(request):
+    return TestApplication(__name__, request_timing = True, request_timing_header = True,
+        secret_key = "foobar")
+
+def test_timing_is_disabled_by_default(app):
+    response = app.run_request(path="/huhu")
+    assert app.timing is None
+    assert "Server-Timing" not in response.headers
+
+def test_phases_are_recorded(timing_app):
+    response = timing_app.run_request(path="/session")
+    header = response.headers['Server-Timing']
+    for phase in ("routing", "handler", "session_open", "session_save", "finalize", "total"):
+        assert phase + ";dur=" in header
+    stats = timing_app.timing.get_stats()
+    assert stats['session']['handler']['count'] == 1
+    assert set(stats['session']['total']) == set(['count', 'p50', 'p95', 'p99'])
+
+def test_stats_per_endpoint(timing_app):
+    for i in range(3):
+        timing_app.run_request(path="/huhu")
+    timing_app.run_request(path="/session")
+    stats = timing_app.timing.get_stats("huhu")
+    assert stats.keys() == ["huhu"]
+    assert stats['huhu']['total']['count'] == 3
+    assert "session_open" not in stats['huhu']
+    timing_app.timing.reset()
+    assert timing_app.timing.get_stats() == {}
+
+def test_errors_are_timed(timing_app):
+    response = timing_app.run_request(path="/does_not_exist")
+    assert response.code == 404
+    assert "error" in timing_app.timing.get_stats()[None]
+
+def test_reservoir():
+    r = Reservoir(10)
+    for i in range(1000):
+        r.add(i)
+    assert r.count == 1000
+    assert len(r.samples) == 10
+    r = Reservoir(100)
+    for i in range(100):
+        r.add(i)
+    assert r.percentile(50) == 50
+    assert r.percentile(99) == 99
+
+def test_request_timer():
+    timer = RequestTimer()
+    timer.mark("a")
+    timer.add("b", 0.5)
+    assert [phase for phase, duration in timer.phases] == ["a", "b"]
+    assert "b;dur=500.000" in timer.server_timing()
@@ -0,0 +1,130 @@
+"""
+instrumentation for measuring how long the phases of a request take.
+
+If ``request_timing`` is enabled in the configuration each request gets a
+:class:`RequestTimer` as ``request.timer`` which records the duration of the
+following phases:
+
+* ``routing``: matching the URL and creating the handler
+* ``before_handler``: the ``before_handler`` hooks of app and modules
+* ``handler``: the handler method itself (including ``session_open``)
+* ``session_open``: loading the session, only if the handler uses it
+* ``after_handler``: the ``after_handler`` hooks of app and modules
+* ``error``: handling an exception raised in one of the phases above
+* ``session_save``: saving the session
+* ``finalize``: ``finalize_response()`` and response compression
+
+The timings are collected per endpoint by :class:`TimingStats` which is available
+as ``app.timing``.
+"""
+
+import time
+import random
+import threading
+
+__all__ = ['RequestTimer', 'TimingStats', 'Reservoir']
+
+class RequestTimer(object):
+    """records the durations of the phases of one request"""
+
+    __slots__ = ('start', 'last', 'phases')
+
+    def __init__(self):
+        self.start = self.last = time.time()
+        self.phases = []
+
+    def mark(self, phase):
+        """record the time since the last mark as duration of ``phase``"""
+        now = time.time()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def add(self, phase, duration):
+        """record a duration for ``phase`` without moving the last mark, e.g. for
+        phases which happen inside other phases"""
+        self.phases.append((phase, duration))
+
+    @property
+    def total(self):
+        """the time passed since the timer has been created"""
+        return self.last - self.start
+
+    def server_timing(self):
+        """return the value for a ``Server-Timing`` header"""
+        return ", ".join(["%s;dur=%.3f" %(phase, duration * 1000)
+            for phase, duration in self.phases + [("total", self.total)]])
+
+
+class Reservoir(object):
+    """keeps a uniform random sample of at most ``size`` values"""
+
+    __slots__ = ('size', 'count', 'samples')
+
+    def __init__(self, size):
+        self.size = size
+        self.count = 0
+        self.samples = []
+
+    def add(self, value):
+        """add a value to the sample"""
+        self.count += 1
+        if len(self.samples) < self.size:
+            self.samples.append(value)
+        else:
+            i = random.randrange(self.count)
+            if i < self.size:
+                self.samples[i] = value
+
+    def percentile(self, p):
+        """return the ``p``-th percentile of the sampled values"""
+        if not self.samples:
+            return None
+        samples = sorted(self.samples)
+        return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+
+class TimingStats(object):
+    """collects the phase durations of requests per endpoint"""
+
+    percentiles = (50, 95, 99)
+
+    def __init__(self, samples = 1000):
+        """initialize the statistics
+
+        :param samples: the number of durations to keep per endpoint and phase
+        """
+        self.samples = samples
+        self.reservoirs = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, timer):
+        """record the durations of a finished :class:`RequestTimer`"""
+        with self._lock:
+            for phase, duration in timer.phases + [("total", timer.total)]:
+                key = (endpoint, phase)
+                reservoir = self.reservoirs.get(key)
+                if reservoir is None:
+                    reservoir = self.reservoirs[key] = Reservoir(self.samples)
+                reservoir.add(duration)
+
+    def get_stats(self, endpoint = None):
+        """return the statistics in milliseconds as a dictionary of the form
+        ``{endpoint: {phase: {'count': 12, 'p50': 0.3, 'p95': 1.2, 'p99': 1.5}}}``
+
+        :param endpoint: only return the statistics of this endpoint
+        """
+        rv = {}
+        with self._lock:
+            for (ep, phase), reservoir in self.reservoirs.items():
+                if endpoint is not None and ep != endpoint:
+                    continue
+                stats = {'count' : reservoir.count}
+                for p in self.percentiles:
+                    stats['p%s' %p] = reservoir.percentile(p) * 1000
+                rv.setdefault(ep, {})[phase] = stats
+        return rv
+
+    def reset(self):
+        """remove all collected durations"""
+        with self._lock:
+            self.reservoirs = {}
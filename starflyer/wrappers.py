@@ -49,6 +49,10 @@ class Request(RequestBase):
     #: we store it here so we do not have to pass it around all the time.
     url_adapter = None
 
+    #: the :class:`~starflyer.timing.RequestTimer` measuring this request if
+    #: ``request_timing`` is enabled in the configuration.
+    timer = None
+
     @property
     def endpoint(self):
         """The endpoint that matched the request.  This in combination with